@@ -0,0 +1,126 @@
+import json
+import random
+
+
+class Page(object):
+    def __init__(self, url, status=200, content=b'', content_type='text/html'):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.content_type = content_type
+
+
+class Corpus(object):
+    ''' A set of pages the stand-in cache server answers from, keyed by url. '''
+
+    def __init__(self, seeds=None):
+        self.pages = dict()
+        self.seeds = list(seeds or [])
+
+    def __len__(self):
+        return len(self.pages)
+
+    def add(self, page):
+        self.pages[page.url] = page
+
+    def get(self, url):
+        return self.pages.get(url)
+
+    def save(self, path):
+        #one json object per line: url, status, content type and the body as text
+        with open(path, 'w') as file:
+            file.write(json.dumps({'seeds': self.seeds}) + '\n')
+            for page in self.pages.values():
+                file.write(json.dumps({
+                    'url': page.url, 'status': page.status, 'content_type': page.content_type,
+                    'content': page.content.decode('utf-8', errors='replace')}) + '\n')
+
+    @classmethod
+    def load(cls, path):
+        #a recorded corpus in the same format as save()
+        with open(path, 'r') as file:
+            corpus = cls(json.loads(file.readline())['seeds'])
+            for line in file:
+                entry = json.loads(line)
+                corpus.add(Page(
+                    entry['url'], entry['status'], entry['content'].encode('utf-8'),
+                    entry.get('content_type', 'text/html')))
+        return corpus
+
+
+def _html(title, paragraphs, links):
+    body = ''.join(f'<p>{p}</p>' for p in paragraphs)
+    anchors = ''.join(f'<a href="{link}">{link}</a>\n' for link in links)
+    return (f'<html><head><title>{title}</title><style>p {{margin: 0}}</style>'
+            f'<script>var x = 1;</script></head><body>{body}{anchors}</body></html>').encode('utf-8')
+
+
+def synthetic(pages=2000, hosts=8, links_per_page=12, duplicate_rate=0.1, trap_length=200,
+              search_trap=300, huge_pages=2, huge_words=200000, error_rate=0.03, seed=0):
+    ''' Builds a reproducible corpus that looks like a crawl of the ics sites:
+    a link graph over several subdomains, near duplicate pages, a calendar
+    trap, a search trap of low info result pages, error statuses and a few
+    huge word list pages. '''
+    rand = random.Random(seed)
+    vocabulary = [f'{a}{b}{c}' for a in 'bcdfghklmnprst' for b in 'aeiou' for c in 'bdgklmnprstvz']
+    host_names = [f'https://host{i}.ics.uci.edu' for i in range(hosts)]
+    urls = [f'{rand.choice(host_names)}/page/{i}' for i in range(pages)]
+    corpus = Corpus([urls[0]])
+
+    def paragraphs(count):
+        return [' '.join(rand.choice(vocabulary) for _ in range(rand.randint(20, 80)))
+                for _ in range(count)]
+
+    trap_start = f'{host_names[0]}/calendar?date=0'
+    for i, url in enumerate(urls):
+        links = [rand.choice(urls) for _ in range(links_per_page)]
+        #links to pages outside the crawl domains and to files that is_valid rejects
+        links += ['https://www.example.com/', f'{url}/slides.pdf', f'{url}#section']
+        if i % 50 == 0:
+            links.append(trap_start)
+        #the seed page is always a normal page
+        roll = rand.random() if i > 0 else 1.0
+        if roll < error_rate:
+            corpus.add(Page(url, rand.choice([404, 500, 603]), b''))
+        elif roll < error_rate + 0.05:
+            #low info page, fewer than ten words
+            corpus.add(Page(url, 200, _html('short', ['not much here'], links)))
+        else:
+            corpus.add(Page(url, 200, _html(f'page {i}', paragraphs(rand.randint(3, 12)), links)))
+
+    #near duplicates: copies of crawled pages with one word changed, e.g. print views
+    originals = [page for page in list(corpus.pages.values()) if page.status == 200]
+    for i in range(int(pages * duplicate_rate)):
+        original = rand.choice(originals)
+        url = f'{original.url}?print=1&copy={i}'
+        content = original.content.replace(b'<p>', f'<p>{rand.choice(vocabulary)} '.encode('utf-8'), 1)
+        corpus.add(Page(url, 200, content))
+        original.content = original.content.replace(
+            b'</body>', f'<a href="{url}">print</a></body>'.encode('utf-8'))
+
+    #calendar trap: every day links to the next, with the same boilerplate text
+    boilerplate = paragraphs(4)
+    for day in range(trap_length):
+        url = f'{host_names[0]}/calendar?date={day}'
+        links = [f'{host_names[0]}/calendar?date={day + 1}', f'{host_names[0]}/calendar?date={day}&view=week']
+        corpus.add(Page(url, 200, _html(f'calendar {day}', boilerplate + [f'events for day {day}'], links)))
+
+    #search trap: a hub links to many query permutations that all come back nearly empty
+    hub = f'{host_names[1]}/search'
+    results = [f'{hub}?q={rand.choice(vocabulary)}&sort=asc&page={i}' for i in range(search_trap)]
+    corpus.add(Page(hub, 200, _html('search', paragraphs(3), results)))
+    for url in results:
+        corpus.add(Page(url, 200, _html('results', ['no results found'], [hub])))
+    seed_page = corpus.get(urls[0])
+    seed_page.content = seed_page.content.replace(
+        b'</body>', f'<a href="{hub}">search</a></body>'.encode('utf-8'))
+
+    #huge pages like ~kay/wordlist.txt
+    for i in range(huge_pages):
+        url = f'{host_names[-1]}/~kay/wordlist{i}.txt'
+        words = ' '.join(rand.choice(vocabulary) + str(rand.randint(0, 9)) * (j % 2) for j in range(huge_words))
+        corpus.add(Page(url, 200, words.encode('utf-8'), 'text/plain'))
+        seed_page = corpus.get(urls[0])
+        seed_page.content = seed_page.content.replace(
+            b'</body>', f'<a href="{url}">words</a></body>'.encode('utf-8'))
+    return corpus
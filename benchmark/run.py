@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import shutil
+import tempfile
+import resource
+import tracemalloc
+
+from functools import wraps
+from configparser import ConfigParser
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.corpus import Corpus, synthetic
+from benchmark.server import StandInCacheServer
+from utils.config import Config
+from utils.response import Response
+
+
+class StageTimer(object):
+    ''' Collects wall clock latencies per named stage. '''
+
+    def __init__(self):
+        self.samples = dict()
+
+    def wrap(self, stage, function):
+        samples = self.samples.setdefault(stage, [])
+
+        if asyncio.iscoroutinefunction(function):
+            @wraps(function)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+            return timed_async
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return timed
+
+    def patch(self, stage, owner, name):
+        setattr(owner, name, self.wrap(stage, getattr(owner, name)))
+
+    def summary(self) -> dict:
+        result = dict()
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[stage] = {
+                'count': len(ordered),
+                'total_s': sum(ordered),
+                'mean_ms': 1000 * sum(ordered) / len(ordered),
+                'p50_ms': 1000 * ordered[len(ordered) // 2],
+                'p95_ms': 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                'max_ms': 1000 * ordered[-1]}
+        return result
+
+
+def make_config(config_file, server, save_dir, args) -> Config:
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    cparser["CRAWLER"]["POLITENESS"] = str(args.politeness)
+    cparser["LOCAL PROPERTIES"]["SAVE"] = os.path.join(save_dir, "frontier.db")
+    cparser["LOCAL PROPERTIES"]["THREADCOUNT"] = str(args.threads)
+    cparser["LOCAL PROPERTIES"]["MODE"] = args.mode
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(server.corpus.seeds)
+    config = Config(cparser)
+    config.cache_server = server.address
+    return config
+
+
+def measure(function, *args):
+    #runs function and returns (result, seconds, peak python heap bytes)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+        return result, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_crawl(config_file, server, args) -> dict:
+    import scraper
+    import crawler.worker
+    import crawler.pipeline
+    import utils.async_download
+    from crawler import Crawler
+    from crawler.frontier import Frontier
+    from crawler.async_worker import AsyncWorker
+    from crawler.pipeline import PipelineCrawler
+    from stats import Stats
+
+    timer = StageTimer()
+    timer.patch('download', crawler.worker, 'download')
+    timer.patch('download', crawler.pipeline, 'download')
+    timer.patch('download (async)', utils.async_download.AsyncDownloader, 'download')
+    timer.patch('scraper.analyze_page', scraper, 'analyze_page')
+    timer.patch('scraper.apply_page', scraper, 'apply_page')
+    timer.patch('frontier.get_tbd_url (politeness wait)', Frontier, 'get_tbd_url')
+    timer.patch('frontier.add_url', Frontier, 'add_url')
+    timer.patch('frontier.mark_url_complete', Frontier, 'mark_url_complete')
+    timer.patch('frontier.save_simhash_index', Frontier, 'save_simhash_index')
+    timer.patch('stats.save_stats', Stats, 'save_stats')
+
+    work_dir = tempfile.mkdtemp(prefix='crawl-bench-')
+    cwd = os.getcwd()
+    #Stats and the simhash checkpoints are written to the working directory
+    os.chdir(work_dir)
+    try:
+        config = make_config(config_file, server, work_dir, args)
+        requests_before = server.requests
+        start = time.perf_counter()
+        if config.mode == "async":
+            crawler = Crawler(config, True, worker_factory=AsyncWorker)
+        elif config.mode == "pipeline":
+            crawler = PipelineCrawler(config, True)
+        else:
+            crawler = Crawler(config, True)
+        crawler.start()
+        elapsed = time.perf_counter() - start
+        fetched = server.requests - requests_before
+        report = {
+            'mode': config.mode,
+            'threads': config.threads_count,
+            'pages_fetched': fetched,
+            'unique_pages': crawler.stats.get_unique_pages(),
+            'seconds': elapsed,
+            'pages_per_sec': fetched / elapsed if elapsed else 0.0,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'stages': timer.summary()}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def bench_components(config_file, server, args) -> dict:
+    import cbor
+    import scraper
+    from crawler.frontier import Frontier
+    from stats import Stats
+
+    work_dir = tempfile.mkdtemp(prefix='crawl-bench-')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    report = dict()
+    try:
+        config = make_config(config_file, server, work_dir, args)
+        scraper.configure(config)
+        responses = [Response(cbor.loads(server.reply(url))) for url in server.corpus.pages]
+        pages = [resp for resp in responses if resp.raw_response != None and 200 <= resp.status < 300]
+
+        #scraper: parse, tokenize, simhash and count words for every page in the corpus
+        def analyze():
+            return [scraper.analyze_page(resp.url, resp.raw_response.content) for resp in pages]
+        analyzed, seconds, peak = measure(analyze)
+        report['scraper'] = {'pages': len(pages), 'pages_per_sec': len(pages) / seconds,
+                             'peak_heap_mb': peak / 2 ** 20}
+
+        #frontier: add every discovered link, then hand out and complete every url
+        links = [link for page in analyzed for link in page['links']] + list(server.corpus.pages)
+        #no pages are recorded here, so every url pattern would look like a trap
+        config.trap_min_yield = 0
+        def frontier_ops():
+            frontier = Frontier(config, True)
+            for link in links:
+                frontier.add_url(link)
+            count = 0
+            while True:
+                url, wait = frontier.poll_tbd_url()
+                if url == None:
+                    if wait == None:
+                        break
+                    time.sleep(wait)
+                    continue
+                frontier.mark_url_complete(url)
+                count += 1
+            frontier.close()
+            return count
+        completed, seconds, peak = measure(frontier_ops)
+        report['frontier'] = {'adds': len(links), 'completed': completed,
+                              'ops_per_sec': (len(links) + completed) / seconds,
+                              'peak_heap_mb': peak / 2 ** 20}
+
+        #stats: record every analyzed page and checkpoint every ten pages
+        def stats_ops():
+            stats = Stats(config)
+            for i, page in enumerate(analyzed):
+                stats.add_unique_page(page['url'])
+                stats.add_common_words(page['words'])
+                stats.change_longest_page(page['url'], page['length'])
+                if i % 10 == 0:
+                    stats.save_stats()
+            stats.close()
+            return stats
+        stats, seconds, peak = measure(stats_ops)
+        report['stats'] = {'pages': len(analyzed), 'pages_per_sec': len(analyzed) / seconds,
+                           'peak_heap_mb': peak / 2 ** 20,
+                           'bytes_per_unique_url': stats.get_unique_pages_bytes()}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def print_report(report) -> None:
+    print('CORPUS')
+    for k, v in report['corpus'].items():
+        print(f'  {k}: {v}')
+    if 'components' in report:
+        print('\nCOMPONENTS')
+        for name, values in report['components'].items():
+            print(f'  {name}: ' + ', '.join(
+                f'{k}={v:.1f}' if isinstance(v, float) else f'{k}={v}' for k, v in values.items()))
+    if 'crawl' in report:
+        crawl = report['crawl']
+        print('\nCRAWL')
+        for k, v in crawl.items():
+            if k != 'stages':
+                print(f'  {k}: {v:.2f}' if isinstance(v, float) else f'  {k}: {v}')
+        print(f'\n  {"stage":<42}{"count":>8}{"total s":>10}{"mean ms":>10}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}')
+        for stage, s in sorted(crawl['stages'].items(), key=lambda x: -x[1]['total_s']):
+            print(f'  {stage:<42}{s["count"]:>8}{s["total_s"]:>10.2f}{s["mean_ms"]:>10.2f}'
+                  f'{s["p50_ms"]:>10.2f}{s["p95_ms"]:>10.2f}{s["max_ms"]:>10.2f}')
+
+
+def main(args):
+    #the crawl runs in a temporary directory
+    args.config_file = os.path.abspath(args.config_file)
+    if args.corpus:
+        corpus = Corpus.load(args.corpus)
+    else:
+        corpus = synthetic(pages=args.pages, huge_words=args.huge_words, seed=args.seed)
+    if args.save_corpus:
+        corpus.save(args.save_corpus)
+    server = StandInCacheServer(corpus, latency=args.latency).start()
+    report = {'corpus': {'pages': len(corpus), 'seeds': len(corpus.seeds), 'latency_s': args.latency}}
+    try:
+        if not args.skip_components:
+            report['components'] = bench_components(args.config_file, server, args)
+        if not args.skip_crawl:
+            report['crawl'] = bench_crawl(args.config_file, server, args)
+    finally:
+        server.stop()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Offline crawler benchmark against a local stand-in cache server.")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--corpus", type=str, default=None, help="recorded corpus (jsonl) instead of a synthetic one")
+    parser.add_argument("--save_corpus", type=str, default=None, help="write the corpus used to this jsonl file")
+    parser.add_argument("--pages", type=int, default=2000, help="pages in the synthetic corpus")
+    parser.add_argument("--huge_words", type=int, default=200000, help="words on each huge page")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", type=str, default="threads", choices=["threads", "async", "pipeline"])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--politeness", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every cache server reply")
+    parser.add_argument("--skip_crawl", action="store_true", default=False)
+    parser.add_argument("--skip_components", action="store_true", default=False)
+    parser.add_argument("--json", type=str, default=None, help="also write the numbers to this json file")
+    main(parser.parse_args())
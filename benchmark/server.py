@@ -0,0 +1,88 @@
+import time
+import pickle
+import cbor
+import requests
+
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def encode_page(url, page):
+    ''' The cache server reply for a page: a cbor dict holding a pickled
+    requests.Response, which is what utils/download.download decodes. '''
+    if page == None:
+        return cbor.dumps({'url': url, 'status': 404, 'response': pickle.dumps(_raw_response(url, 404, b''))})
+    if page.status >= 600:
+        return cbor.dumps({'url': url, 'status': page.status, 'error': f'Stand-in cache error {page.status}'})
+    raw = _raw_response(url, page.status, page.content, page.content_type)
+    return cbor.dumps({'url': url, 'status': page.status, 'response': pickle.dumps(raw)})
+
+
+def _raw_response(url, status, content, content_type='text/html'):
+    raw = requests.models.Response()
+    raw.url = url
+    raw.status_code = status
+    raw._content = content
+    raw.headers['Content-Type'] = content_type
+    raw.headers['Content-Length'] = str(len(content))
+    raw.encoding = 'utf-8'
+    return raw
+
+
+class StandInCacheServer(object):
+    ''' Local HTTP stand-in for the spacetime cache server.
+
+    Answers GET /?q=<url>&u=<user agent> from a Corpus. Replies are encoded
+    once and reused, and latency seconds are added to every reply to model the
+    round trip to the real server. '''
+
+    def __init__(self, corpus, host='127.0.0.1', port=0, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.requests = 0
+        self._replies = dict()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            #headers and body are separate writes, avoid the delayed ack stall on keep-alive
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                url = query.get('q', [''])[0]
+                server.requests += 1
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                body = server.reply(url)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/cbor')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def reply(self, url):
+        if url not in self._replies:
+            self._replies[url] = encode_page(url, self.corpus.get(url))
+        return self._replies[url]
+
+    def start(self):
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,17 +1,34 @@
-from utils import get_logger
+import time
+
+from utils import get_logger, metrics
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 import stats
+import scraper
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        scraper.configure(config)
+        start = time.perf_counter()
         self.frontier = frontier_factory(config, restart)
+        frontier_time = time.perf_counter() - start
         self.workers = list()
         self.worker_factory = worker_factory
         #keep track of stats for report as part of crawler
-        self.stats = stats.Stats()
+        self.stats = stats.Stats(config, logger=self.logger)
+        self.logger.info(
+            f"Startup took {time.perf_counter() - start:.2f}s "
+            f"(frontier {frontier_time:.2f}s, stats {time.perf_counter() - start - frontier_time:.2f}s).")
+        metrics.configure(config, get_logger("METRICS"))
+        #gauges are read only when metrics are dumped or scraped
+        metrics.gauge('frontier_queue_depth', lambda: self.frontier.tbd_count)
+        metrics.gauge('frontier_hosts', lambda: len(self.frontier.to_be_downloaded))
+        metrics.gauge('frontier_active_hosts', lambda: len(self.frontier.active_hosts))
+        metrics.gauge('unique_pages', self.stats.get_unique_pages)
+        metrics.gauge('hosts_backed_off', lambda: self.frontier.rates.backed_off())
+        metrics.gauge('host_delay_mean', lambda: round(self.frontier.rates.mean_delay(), 3))
 
     def start_async(self):
         self.workers = [
@@ -27,3 +44,9 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        self.frontier.close()
+        self.stats.close()
+        metrics.stop(self.logger)
+        self.logger.info(
+            f"{self.stats.get_unique_pages()} unique pages stored at "
+            f"{self.stats.get_unique_pages_bytes():.1f} bytes per url.")
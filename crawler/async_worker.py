@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+from threading import Thread
+
+from utils.async_download import AsyncDownloader
+from utils import get_logger, metrics
+import scraper
+
+
+class AsyncWorker(Thread):
+    ''' Runs many fetches at once on one asyncio event loop.
+
+    Each of the config.concurrency tasks takes a url from the frontier,
+    awaits the download through a shared keep-alive connection pool and runs
+    the scraper inline on the loop thread, so Stats and the Frontier still see
+    one caller per worker. '''
+
+    def __init__(self, worker_id, config, frontier, stats):
+        self.logger = get_logger(f"AsyncWorker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        self.stats = stats
+        #this worker's stats, merged into the shared stats at every backup
+        self.shard = stats.shard()
+        self.backup_counter = 0
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.run(self._crawl())
+
+    async def _crawl(self):
+        downloader = AsyncDownloader(self.config, self.logger)
+        try:
+            await asyncio.gather(*[
+                self._fetch_loop(downloader)
+                for _ in range(self.config.concurrency)])
+        finally:
+            await downloader.close()
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def _fetch_loop(self, downloader):
+        while True:
+            #backup the stats and simhashes to local files after every ten pages
+            if self.backup_counter >= 10:
+                with metrics.timer('checkpoint.submit'):
+                    #the frontier commits first, the checkpoints cover only completed pages
+                    self.frontier.save_simhash_index()
+                    self.stats.save_stats(self.shard)
+                self.backup_counter = 0
+            else:
+                self.backup_counter += 1
+
+            #never block the event loop waiting on the politeness delay
+            tbd_url, wait = self.frontier.poll_tbd_url()
+            if not tbd_url:
+                if wait is None:
+                    break
+                await asyncio.sleep(wait)
+                continue
+            #concurrent downloads overlap, so these add up to more than the wall clock
+            resp = self.frontier.stored_response(tbd_url)
+            if resp == None:
+                start = time.perf_counter()
+                with metrics.timer('download'):
+                    resp = await downloader.download(tbd_url)
+                metrics.count('pages_downloaded')
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                #a failed fetch may go back in the frontier to be retried after its host backs off
+                if self.frontier.record_fetch(tbd_url, resp, time.perf_counter() - start):
+                    continue
+                self.frontier.store_response(tbd_url, resp)
+            else:
+                self.logger.info(f"Reused stored page for {tbd_url}.")
+            with metrics.timer('scraper'):
+                scraped_urls = scraper.scraper(tbd_url, resp, self.shard, self.frontier)
+            new_links = 0
+            with metrics.timer('frontier.add_url'):
+                for scraped_url in scraped_urls:
+                    new_links += self.frontier.add_url(scraped_url, tbd_url)
+            with metrics.timer('frontier.complete'):
+                self.frontier.mark_url_complete(tbd_url, new_links)
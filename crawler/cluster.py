@@ -0,0 +1,232 @@
+import json
+import uuid
+
+from threading import Thread, Event
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from utils import get_logger, normalize, metrics
+from utils.simhash import hash64
+from crawler.frontier import Frontier
+
+
+def host_owner(host: str, nodes: int) -> int:
+    #rendezvous hashing: every node scores the host, the highest score owns it,
+    #so adding a node only moves the hosts the new node wins
+    return max(range(nodes), key=lambda node: hash64(f"{node}/{host}"))
+
+
+def request(address, authkey, message, reply=False):
+    #one message per connection, json so a peer can never make us unpickle anything
+    with Client(address, authkey=authkey) as conn:
+        conn.send_bytes(json.dumps(message).encode("utf-8"))
+        if reply:
+            return conn.recv_bytes()
+
+
+class ClusterFrontier(Frontier):
+    ''' The frontier shard of one node in a multi node crawl.
+
+    Hosts are partitioned over the nodes with host_owner, so each node keeps
+    the politeness delay, trap budgets and save file of its own hosts only.
+    Links to hosts owned by another node are queued per node and forwarded in
+    batches of FORWARDBATCH, or every FORWARDINTERVAL seconds, to the node's
+    listener; the receiving node adds them with the depth and score they
+    were found with.
+
+    A node whose shard runs dry keeps waiting, a peer may still forward it
+    links. Node 0 asks every node whether it is idle and how many links it
+    has sent and received; once two rounds in a row find every node idle
+    with the same totals and nothing in transit, it tells every node to stop. '''
+
+    def __init__(self, config, restart):
+        self.node_id = config.node_id
+        self.peers = config.peers
+        self.authkey = config.user_agent.encode("utf-8")
+        self.cluster_logger = get_logger(f"NODE-{self.node_id}", "CLUSTER")
+        #node -> links waiting to be forwarded to it, as [url, depth, base]
+        self.outbox = {node: list() for node in range(len(self.peers)) if node != self.node_id}
+        #set when a node has a full batch waiting, or the crawl is over, wakes the forwarder
+        self.outbox_full = Event()
+        self.owners = dict()
+        #links forwarded to and received from the other nodes, for termination detection
+        self.sent = 0
+        self.received = 0
+        #batches are numbered per sender run, a batch sent again after a lost reply is only counted once
+        self.session = uuid.uuid4().hex
+        self.batches = {node: 0 for node in self.outbox}
+        self.last_batch = dict()
+        self.finished = Event()
+        #node -> final stats state, only used on node 0
+        self.node_stats = dict()
+        self.stats_received = Event()
+        self.listener = Listener(self.peers[self.node_id], authkey=self.authkey)
+        super().__init__(config, restart)
+        Thread(target=self._serve, daemon=True).start()
+        self.forwarder = Thread(target=self._forward, daemon=True)
+        self.forwarder.start()
+        if self.node_id == 0:
+            Thread(target=self._detect_termination, daemon=True).start()
+
+    def owner(self, host):
+        if host not in self.owners:
+            self.owners[host] = host_owner(host, len(self.peers))
+        return self.owners[host]
+
+    def add_url(self, url, parent=None):
+        #links to hosts of other nodes are forwarded, they count as not new here
+        url = normalize(url)
+        canonical, urlhash = self.canonical.key(url)
+        with self.lock:
+            #every variant of a url goes to the same node, where it is deduplicated
+            node = self.owner(self._get_host(canonical))
+            if node == self.node_id:
+                return self._add(url, *self._link_priority(parent), urlhash)
+            depth, base = self._link_priority(parent)
+            links = self.outbox[node]
+            links.append([url, depth, base])
+            if len(links) >= self.config.forward_batch:
+                self.outbox_full.set()
+            return False
+
+    def poll_tbd_url(self):
+        url, wait = super().poll_tbd_url()
+        if url == None and wait == None and not self.finished.is_set():
+            #the shard is empty but other nodes may still forward links to it
+            return None, self.config.forward_interval
+        return url, wait
+
+    def is_idle(self):
+        #nothing queued, nothing being downloaded and nothing waiting to be forwarded
+        with self.lock:
+            return (self.tbd_count == 0 and not self.active_hosts
+                    and not any(self.outbox.values()))
+
+    def _serve(self):
+        while True:
+            try:
+                with self.listener.accept() as conn:
+                    message = json.loads(conn.recv_bytes().decode("utf-8"))
+                    kind = message["type"]
+                    if kind == "links":
+                        sender = message["session"]
+                        with self.lock:
+                            if message["batch"] > self.last_batch.get(sender, 0):
+                                for url, depth, base in message["links"]:
+                                    self._add(url, depth, base)
+                                self.received += len(message["links"])
+                                self.last_batch[sender] = message["batch"]
+                                metrics.count('links_received', len(message["links"]))
+                        conn.send_bytes(b"ok")
+                    elif kind == "status":
+                        with self.lock:
+                            conn.send_bytes(json.dumps(
+                                {"idle": self.is_idle(), "sent": self.sent,
+                                 "received": self.received}).encode("utf-8"))
+                    elif kind == "stop":
+                        self._finish()
+                    elif kind == "stats":
+                        self.node_stats[message["node"]] = message["stats"]
+                        if len(self.node_stats) == len(self.peers) - 1:
+                            self.stats_received.set()
+                    elif kind == "close":
+                        break
+            except (OSError, EOFError, ValueError, KeyError, AuthenticationError) as e:
+                self.cluster_logger.error(f"Bad message from a peer: {e!r}")
+        self.listener.close()
+
+    def _forward(self):
+        #only this thread removes links from the outbox, so the batch it sends stays at its head
+        while not self.finished.is_set():
+            #cleared before sending, a batch filled meanwhile sets it again
+            self.outbox_full.clear()
+            for node, links in self.outbox.items():
+                while links:
+                    with self.lock:
+                        batch = links[:self.config.forward_batch]
+                    try:
+                        request(self.peers[node], self.authkey,
+                                {"type": "links", "session": self.session,
+                                 "batch": self.batches[node] + 1, "links": batch}, reply=True)
+                    except (OSError, EOFError, AuthenticationError) as e:
+                        #the node may not be up yet, the batch is sent again next round
+                        self.cluster_logger.warning(
+                            f"Could not forward {len(batch)} links to node {node}: {e!r}")
+                        break
+                    with self.lock:
+                        del links[:len(batch)]
+                        self.sent += len(batch)
+                        self.batches[node] += 1
+                    metrics.count('links_forwarded', len(batch))
+            self.outbox_full.wait(self.config.forward_interval)
+
+    def _detect_termination(self):
+        last = None
+        while not self.finished.wait(self.config.forward_interval):
+            statuses = list()
+            try:
+                for node, address in enumerate(self.peers):
+                    if node == self.node_id:
+                        with self.lock:
+                            statuses.append((self.is_idle(), self.sent, self.received))
+                    else:
+                        status = json.loads(request(address, self.authkey, {"type": "status"}, reply=True))
+                        statuses.append((status["idle"], status["sent"], status["received"]))
+            except (OSError, EOFError):
+                #a node that is not reachable is not done
+                last = None
+                continue
+            except (ValueError, KeyError, AuthenticationError) as e:
+                #nor is one that does not answer properly
+                self.cluster_logger.error(f"Bad status reply from a peer: {e!r}")
+                last = None
+                continue
+            idle = all(status[0] for status in statuses)
+            totals = (sum(status[1] for status in statuses), sum(status[2] for status in statuses))
+            #counters only grow, equal totals two rounds in a row mean nothing moved in between
+            if idle and totals[0] == totals[1] and totals == last:
+                self.cluster_logger.info(
+                    f"Every node is idle, {totals[0]} links were forwarded. Stopping the cluster.")
+                for node, address in enumerate(self.peers):
+                    if node != self.node_id:
+                        try:
+                            request(address, self.authkey, {"type": "stop"})
+                        except (OSError, AuthenticationError) as e:
+                            self.cluster_logger.error(f"Could not stop node {node}: {e!r}")
+                self._finish()
+                return
+            last = totals if idle and totals[0] == totals[1] else None
+
+    def _finish(self):
+        self.finished.set()
+        self.outbox_full.set()
+        with self.lock:
+            #wake the workers waiting on an empty shard so they can stop
+            self.ready.notify_all()
+
+    def close(self):
+        self.finished.set()
+        self.outbox_full.set()
+        self.forwarder.join()
+        super().close()
+
+    def write_report(self, stats, path, timeout=600):
+        ''' Node 0 waits for the stats of every other node and writes the
+        merged report, the other nodes send their stats to node 0. '''
+        if self.node_id != 0:
+            try:
+                request(self.peers[0], self.authkey,
+                        {"type": "stats", "node": self.node_id, "stats": stats.to_state()})
+            except OSError as e:
+                self.cluster_logger.error(f"Could not send the stats to node 0: {e!r}")
+        else:
+            if not self.stats_received.wait(timeout):
+                missing = set(range(1, len(self.peers))) - set(self.node_stats)
+                self.cluster_logger.error(f"No stats from nodes {sorted(missing)}, the report leaves them out.")
+            for node, state in sorted(self.node_stats.items()):
+                stats.merge_state(state)
+            stats.write_report(path)
+        try:
+            request(self.peers[self.node_id], self.authkey, {"type": "close"})
+        except OSError:
+            pass
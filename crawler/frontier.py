@@ -1,26 +1,112 @@
 import os
-import shelve
 import json
+import math
+import time
+import heapq
 
-from threading import Thread, RLock
-from queue import Queue, Empty
+from threading import RLock, Condition
+from urllib.parse import urlparse
+
+from utils import get_logger, normalize, metrics
+from utils.canonical import Canonicalizer
+from utils.simhash import SimhashIndex
+from utils.checkpoint import Checkpointer
+from crawler.store import FrontierStore
+from crawler.pagestore import PageStore
+from crawler.spill import SpillQueue
+from utils.traps import TrapDetector
+from utils.rate import RateController, is_overloaded
+from scraper import is_valid, response_body
+
+def empty_simhash_state():
+    return {'simhashes': []}
+
+def apply_simhash_delta(state, delta):
+    #older snapshots stored the simhashes as a plain list
+    if isinstance(state, list):
+        state = {'simhashes': state}
+    state['simhashes'].extend(delta)
+    return state
+
+#share of the parent's cost that its links inherit
+PARENT_COST = 0.5
+#cost of a url pattern that keeps none of its pages
+PATTERN_COST = 4.0
+#cost per doubling of the pages already fetched from a host
+HOST_COST = 0.5
+
+#most urls re-scored per url handed out
+RESCORE_LIMIT = 64
+#shortest wait poll_tbd_url asks for while only urls in flight are left, so a
+#caller without politeness delay does not spin until they complete
+BUSY_WAIT = 0.05
+
+def base_score(depth, parent_cost):
+    #depth from the seeds plus part of the cost of the page that linked to the url
+    return depth + PARENT_COST * parent_cost
+
+def url_score(base, pattern_yield):
+    ''' Priority of a url, lower is fetched first: its base score plus a cost
+    for url patterns that have kept few of their fetched pages. Links found
+    on a page reached through a poor pattern inherit part of its cost. The
+    pattern cost is checked again when the url reaches the top of its host
+    heap, since traps are often queued before their first page is fetched. '''
+    if pattern_yield == None:
+        return base
+    return base + PATTERN_COST * (1.0 - pattern_yield)
 
-from utils import get_logger, get_urlhash, normalize
-from scraper import is_valid
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        #keep a set of all simhash fingerprints to compare similarity
-        self.simhash_index = set()
+        #every host gets its own heap of (score, order, url, depth, base) so politeness can be kept per host
+        self.to_be_downloaded = dict()
+        self.order = 0
+        #heap of (next allowed fetch time, host) for hosts that have urls waiting
+        self.ready_hosts = list()
+        #heap of (priority, host) for hosts past their politeness delay
+        self.due_hosts = list()
+        #pages fetched per host, hosts covered less are preferred
+        self.host_fetches = dict()
+        #url -> (depth, score, base) of the urls handed out, the links they add are scored from them
+        self.in_flight = dict()
+        #hosts that currently have a url handed out to a worker
+        self.active_hosts = set()
+        #hosts that are waiting in the ready_hosts or due_hosts heap
+        self.scheduled_hosts = set()
+        self.next_fetch = dict()
+        #urls waiting, in memory plus spilled
+        self.tbd_count = 0
+        #at most max_queued urls are kept in memory, the rest wait in segment files on disk
+        self.max_queued = self.config.max_queued
+        self.queued = 0
+        self.spill = SpillQueue(f"{self.config.save_file}.spill", self.config.spill_segment)
+        #fetch budgets per url pattern, so traps stop getting fetched once they stop yielding pages
+        self.traps = TrapDetector(self.config.trap_samples, self.config.trap_min_yield, self.logger)
+        #delay per host, backed off when the cache server fails or answers slowly, never below politeness
+        self.rates = RateController(
+            self.config.time_delay, self.config.max_delay, self.config.backoff, self.config.latency_target,
+            self.config.recovery, self.config.max_retries, self.config.retry_budget)
+        #urls are keyed by the fingerprint of their canonical form, so variants of a page are fetched once
+        self.canonical = Canonicalizer(self.config.canonical_rules, self.config.drop_params)
+        self.lock = RLock()
+        self.ready = Condition(self.lock)
+        #index of all simhash fingerprints to find near duplicate pages
+        self.simhash_index = SimhashIndex(self.config.simhash_distance)
+        #url -> simhash it added, until the url is marked complete, and the simhashes
+        #a checkpoint held back because their page was not complete yet
+        self.page_simhashes = dict()
+        self.held_simhashes = list()
+        self.simhash_checkpoint = Checkpointer(
+            'simhash_snapshot.txt', 'simhash_log.txt', empty_simhash_state, apply_simhash_delta,
+            arrays=('simhashes',))
         #if continuing the crawl from a previous point, load the simhashes
         try:
             self.load_simhash_index()
         except:
             pass
-        
+
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
@@ -30,13 +116,21 @@ class Frontier(object):
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            FrontierStore.remove(self.config.save_file)
+        #downloaded pages outlive restarts, a crawl from the seed can still reuse them
+        self.pages = None
+        if self.config.page_store:
+            self.pages = PageStore(
+                self.config.page_store, self.config.page_store_bytes, self.config.durability_interval)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = FrontierStore(
+            self.config.save_file, self.config.durability_interval, self.config.bloom_capacity)
+        self._check_canonical_rules()
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
         else:
+            self._load_yields()
             # Set the frontier state with contents of save file.
             self._parse_save_file()
             if not self.save:
@@ -47,55 +141,321 @@ class Frontier(object):
         ''' This function can be overridden for alternate saving techniques. '''
         total_count = len(self.save)
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and is_valid(url):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        with self.lock:
+            #completed urls are never read, restart time grows with the pending urls only
+            for url, depth, base in self.save.pending():
+                if is_valid(url):
+                    tbd_count += 1
+                    host = self._get_host(url)
+                    if self._full() and host in self.to_be_downloaded:
+                        self.spill.push(url, depth, base)
+                        continue
+                    if host not in self.to_be_downloaded:
+                        self.to_be_downloaded[host] = list()
+                    #pattern costs are added when each url reaches the top of its heap
+                    self.to_be_downloaded[host].append((base, self.order, url, depth, base))
+                    self.order += 1
+                    self.queued += 1
+            #one heapify per host instead of a push per url
+            for host, queue in self.to_be_downloaded.items():
+                heapq.heapify(queue)
+                self._schedule_host(host)
+            self.tbd_count += tbd_count
         self.logger.info(
-            f"Found {tbd_count} urls to be downloaded from {total_count} "
-            f"total urls discovered.")
+            f"Found {tbd_count} urls to be downloaded ({len(self.spill)} spilled to disk) "
+            f"from {total_count} total urls discovered.")
+
+    def _get_host(self, url):
+        return urlparse(url).netloc.lower()
+
+    def _check_canonical_rules(self):
+        #urls are keyed by their canonical form, a save file written with other rules is keyed again
+        settings = json.dumps(self.canonical.settings)
+        if self.save.get_meta('canonical') == settings:
+            return
+        if self.save:
+            start = time.time()
+            changed = self.save.rekey(self._url_key)
+            self.logger.info(
+                f"Canonical url rules changed, keyed {changed} saved urls again "
+                f"in {time.time() - start:.1f}s.")
+        self.save.set_meta('canonical', settings)
+        self.save.sync(force=True)
+
+    def _save_yields(self):
+        self.save.set_meta('yields', json.dumps(
+            {'patterns': self.traps.state(), 'hosts': self.host_fetches}))
+
+    def _commit(self, force=False):
+        #group commit, the yields go in with it so a crash loses at most one interval of them
+        with metrics.timer('frontier.sync'):
+            if self.save.commit_due():
+                self._save_yields()
+                self.save.sync(force=True)
+            elif force:
+                self.save.sync(force=True)
+
+    def _load_yields(self):
+        #pattern yields and host coverage of the last run, saved with the group commits
+        state = self.save.get_meta('yields')
+        if state != None:
+            state = json.loads(state)
+            self.traps.load(state['patterns'])
+            self.host_fetches.update(state['hosts'])
+
+    def _full(self):
+        return self.max_queued > 0 and self.queued >= self.max_queued
+
+    def _push_url(self, url, depth=0, base=0.0):
+        #add the url to its host heap and schedule the host if it is idle
+        host = self._get_host(url)
+        self.tbd_count += 1
+        if self._full() and host in self.to_be_downloaded:
+            #the window is full, every host still keeps at least one url in memory
+            self.spill.push(url, depth, base)
+            return
+        if host not in self.to_be_downloaded:
+            self.to_be_downloaded[host] = list()
+        score = url_score(base, self.traps.pattern_yield(url))
+        heapq.heappush(self.to_be_downloaded[host], (score, self.order, url, depth, base))
+        #ties go first in first out, breadth first
+        self.order += 1
+        self.queued += 1
+        self._schedule_host(host)
+
+    def _refill(self):
+        #once the window is half empty, read spilled urls back into it in one sequential batch
+        if not self.spill or self.queued > self.max_queued // 2:
+            return
+        with metrics.timer('frontier.refill'):
+            for url, depth, base in self.spill.pop_batch(self.max_queued - self.queued):
+                self.tbd_count -= 1
+                self._push_url(url, depth, base)
+
+    def _host_priority(self, host):
+        #best url score of the host plus a cost that grows with the pages already fetched from it
+        return self.to_be_downloaded[host][0][0] + HOST_COST * math.log2(1 + self.host_fetches.get(host, 0))
+
+    def _schedule_host(self, host):
+        if host in self.active_hosts or host in self.scheduled_hosts:
+            return
+        if not self.to_be_downloaded.get(host):
+            return
+        heapq.heappush(self.ready_hosts, (self.next_fetch.get(host, 0.0), host))
+        self.scheduled_hosts.add(host)
+        self.ready.notify()
+
+    def poll_tbd_url(self):
+        ''' Returns (url, None) when a host is ready, (None, wait) when the
+        next host becomes ready in wait seconds, and (None, None) when the
+        frontier is exhausted. Never blocks. '''
+        with self.lock:
+            self._refill()
+            now = time.time()
+            #hosts past their delay move to the due heap, ordered by the priority of their best url
+            while self.ready_hosts and self.ready_hosts[0][0] <= now:
+                host = heapq.heappop(self.ready_hosts)[1]
+                heapq.heappush(self.due_hosts, (self._host_priority(host), host))
+            while self.due_hosts:
+                host = heapq.heappop(self.due_hosts)[1]
+                self.scheduled_hosts.discard(host)
+                url = self._pop_url(host)
+                if url == None:
+                    #every url the host had waiting was in a stopped trap pattern
+                    continue
+                self.active_hosts.add(host)
+                return url, None
+            if self.ready_hosts:
+                return None, self.ready_hosts[0][0] - now
+            if self.active_hosts:
+                #urls in flight can still add new hosts to the frontier
+                return None, max(self.config.time_delay, BUSY_WAIT)
+            return None, None
+
+    def _pop_url(self, host):
+        #next url of the host whose pattern still has fetch budget, others are dropped as traps
+        queue = self.to_be_downloaded[host]
+        url = None
+        rescored = 0
+        while queue:
+            score, order, candidate, depth, base = queue[0]
+            #the pattern may have shown a poor yield since the url was queued, if so it goes back in
+            if rescored < RESCORE_LIMIT:
+                current = url_score(base, self.traps.pattern_yield(candidate))
+                if current > score:
+                    heapq.heapreplace(queue, (current, order, candidate, depth, base))
+                    rescored += 1
+                    continue
+            heapq.heappop(queue)
+            self.tbd_count -= 1
+            self.queued -= 1
+            #a retry was already counted against its pattern the first time
+            if self.rates.retrying(candidate) or self.traps.fetch(candidate):
+                url = candidate
+                self.in_flight[url] = (depth, score, base)
+                self.host_fetches[host] = self.host_fetches.get(host, 0) + 1
+                break
+            #marked complete so it is not downloaded after a restart either
+            self.save[self._url_key(candidate)] = (candidate, True)
+            metrics.count('urls_trapped')
+        if not queue:
+            del self.to_be_downloaded[host]
+        return url
 
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
+        #block until some host is past its politeness delay
+        with self.lock:
+            while True:
+                url, wait = self.poll_tbd_url()
+                if url or wait is None:
+                    if not url:
+                        #wake up the other workers so they can stop as well
+                        self.ready.notify_all()
+                    return url
+                self.ready.wait(wait)
 
-    def add_url(self, url):
+    def add_url(self, url, parent=None):
+        #returns True if the url is new to the frontier, parent is the fetched url that linked to it
         url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
-    
-    def mark_url_complete(self, url):
-        urlhash = get_urlhash(url)
+        urlhash = self.canonical.key(url)[1]
+        with self.lock:
+            return self._add(url, *self._link_priority(parent), urlhash)
+
+    def _link_priority(self, parent):
+        #(depth, base score) of a url found on parent, urls added without a fetched parent are seeds
+        parent_depth, parent_score, _ = self.in_flight.get(parent, (-1, -1.0, 0.0))
+        depth = parent_depth + 1
+        return depth, base_score(depth, parent_score - parent_depth)
+
+    def _url_key(self, url):
+        #fingerprint of the canonical form of the url, the save file and page store key
+        return self.canonical.key(url)[1]
+
+    def _add(self, url, depth, base, urlhash=None):
+        #url is normalized, call with the lock held
+        if not self.traps.allow(url):
+            return False
+        if urlhash == None:
+            urlhash = self._url_key(url)
         if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+            #committed together with the page that found it in mark_url_complete
+            self.save[urlhash] = (url, False, depth, base)
+            self._push_url(url, depth, base)
+            metrics.count('urls_added')
+            return True
+        return False
+
+    def record_page(self, url, outcome):
+        #what a fetched page turned out to be: kept, low_info or duplicate
+        with self.lock:
+            self.traps.record_page(normalize(url), outcome)
+
+    def record_fetch(self, url, resp, seconds):
+        ''' Feeds one download and how long it took to the rate controller.
+        Returns True if the cache server gave no usable reply and the url is
+        queued again, to be retried once its host has backed off; the caller
+        then drops the response without processing it or marking the url
+        complete. '''
+        with self.lock:
+            host = self._get_host(url)
+            self.rates.record(host, seconds, is_overloaded(resp))
+            if not resp.failed or not self.rates.retry(host, url):
+                return False
+            depth, _, base = self.in_flight.pop(url)
+            self._push_url(url, depth, base)
+            self._release_host(host)
+        metrics.count('fetches_retried')
+        return True
 
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+    def _release_host(self, host):
+        #the host may be fetched again once its delay has passed
+        if host in self.active_hosts:
+            self.active_hosts.discard(host)
+            self.next_fetch[host] = time.time() + self.rates.delay(host)
+            self._schedule_host(host)
+        self.ready.notify_all()
 
+    def mark_url_complete(self, url, new_links=0):
+        #new_links is how many urls the page added to the frontier, for the trap detector
+        urlhash = self._url_key(url)
+        with self.lock:
+            self.in_flight.pop(url, None)
+            self.page_simhashes.pop(url, None)
+            self.rates.done(url)
+            self.traps.record_links(normalize(url), new_links)
+            if urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            self.save[urlhash] = (url, True)
+            #group commit, at most once per durability interval and only on page boundaries
+            self._commit()
+
+            self._release_host(self._get_host(normalize(url)))
+        metrics.count('pages_completed')
+
+
+    def close(self):
+        #commit anything still waiting for the durability interval
+        with self.lock:
+            slowest = sorted(self.rates.rates().items(), key=lambda item: -item[1]['delay'])[:10]
+            for host, rate in slowest:
+                if rate['delay'] > self.rates.min_delay:
+                    self.logger.info(
+                        f"{host} ended backed off to {rate['delay']:.2f}s: {rate['failures']} of "
+                        f"{rate['fetches']} fetches failed, latency {rate['latency']:.2f}s.")
+            self._save_yields()
+            self.save.close()
+            #every spilled url is pending in the save file as well
+            self.spill.clear()
+        self.save_simhash_index()
+        self.simhash_checkpoint.close()
+        if self.pages != None:
+            self.pages.close()
+
+    def stored_response(self, url):
+        #the stored page of a url when REUSEPAGES is on, None means download it
+        if self.pages == None or not self.config.reuse_pages:
+            return None
+        return self.pages.get_response(self._url_key(url))
+
+    def store_response(self, url, resp):
+        #only bodies the scraper parses are stored, the checks run before the reply is
+        #unpickled, so a reply skipped for its size or content type is never read here
+        if self.pages != None and response_body(resp, count=False):
+            self.pages.put_response(self._url_key(url), resp)
 
     def get_simhash_index(self):
-        #return the simhash index set
+        #return the simhash index
         return self.simhash_index
 
-    def add_simhash_index(self, simhash):
-        #add a simhash fingerprint to the simhash index set
-        self.simhash_index.add(simhash)
+    def add_simhash_index(self, simhash, url=None):
+        #add a simhash fingerprint to the index unless a near duplicate is already there
+        with self.lock:
+            unique = self.simhash_index.add_if_unique(simhash)
+            if unique and url != None:
+                self.page_simhashes[url] = simhash
+            return unique
+
+    def commit(self):
+        #commit the completed urls now instead of at the next durability interval
+        with self.lock:
+            self._commit(force=True)
 
     def save_simhash_index(self):
-        #use json to dump the simhash index to a local text file as a backup
-        with open('simhash_dump.txt', 'w') as file:
-            json.dump([list(self.simhash_index)], file)
+        #only the fingerprints found since the last backup are appended, off the crawl thread.
+        #A fingerprint is saved only once its page is committed as complete, otherwise after a
+        #crash the page is fetched again and dropped as a near duplicate of itself
+        with self.lock:
+            self.commit()
+            new = self.held_simhashes + self.simhash_index.take_new()
+            in_progress = set(self.page_simhashes.values())
+            self.held_simhashes = [simhash for simhash in new if simhash in in_progress]
+            new = [simhash for simhash in new if simhash not in in_progress]
+        self.simhash_checkpoint.submit(new)
 
     def load_simhash_index(self):
-        #use json to load the simhash fingerprints from a text file backup
-        with open('simhash_dump.txt', 'r') as file:
-            simhashes = json.load(file)
-        self.simhash_index = set(simhashes[0])
-
+        #rebuild the simhash index from the latest snapshot plus the checkpoint log
+        state = self.simhash_checkpoint.load()
+        self.simhash_index.load(state if isinstance(state, list) else state['simhashes'])
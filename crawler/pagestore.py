@@ -0,0 +1,152 @@
+import json
+import time
+import sqlite3
+import requests
+
+from threading import Lock
+
+from utils import get_content_digest
+from utils.response import Response
+
+
+class PageStore(object):
+    ''' Content addressed on-disk store of downloaded pages (SQLite).
+
+    pages maps a url fingerprint to the digest of its body, bodies maps a
+    digest to the bytes and to the scraper's analysis of them (simhash, links,
+    word counts). Mirrors and print views that are byte identical are stored
+    once and parsed once. Bodies are evicted least recently used first once
+    they take more than max_bytes. Like the frontier it commits at most once
+    per durability_interval; it is a cache, a crash only loses recent pages. '''
+
+    def __init__(self, path, max_bytes, durability_interval):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.durability_interval = durability_interval
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "urlhash INTEGER PRIMARY KEY, url TEXT NOT NULL, status INTEGER NOT NULL, "
+            "content_type TEXT NOT NULL, digest BLOB NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bodies ("
+            "digest BLOB PRIMARY KEY, content BLOB NOT NULL, size INTEGER NOT NULL, "
+            "used INTEGER NOT NULL, analysis TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bodies_used ON bodies (used)")
+        self.total_bytes, self.clock = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM bodies").fetchone()
+        self.in_transaction = False
+        self.last_commit = time.time()
+
+    @staticmethod
+    def _key(urlhash):
+        #sqlite integers are signed 64 bit
+        return urlhash - (1 << 64) if urlhash >= (1 << 63) else urlhash
+
+    def _begin(self):
+        if not self.in_transaction:
+            self.conn.execute("BEGIN")
+            self.in_transaction = True
+
+    def _touch(self, digest):
+        self.clock += 1
+        self.conn.execute("UPDATE bodies SET used = ? WHERE digest = ?", (self.clock, digest))
+
+    def get_response(self, urlhash):
+        #a Response rebuilt from the stored body of a url, or None if it is not stored
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT pages.url, pages.status, pages.content_type, bodies.content, bodies.digest "
+                "FROM pages JOIN bodies ON pages.digest = bodies.digest WHERE pages.urlhash = ?",
+                (self._key(urlhash),)).fetchone()
+            if row == None:
+                return None
+            url, status, content_type, content, digest = row
+            self._begin()
+            self._touch(digest)
+            self._sync()
+        raw = requests.models.Response()
+        raw.url = url
+        raw.status_code = status
+        raw._content = content
+        raw.headers['Content-Type'] = content_type
+        raw.headers['Content-Length'] = str(len(content))
+        resp = Response({'url': url, 'status': status})
+        resp.raw_response = raw
+        return resp
+
+    def put_response(self, urlhash, resp) -> None:
+        #store the body of a successful response, bodies already stored are not written again
+        if resp.status < 200 or resp.status > 299 or resp.raw_response == None:
+            return
+        content = resp.raw_response.content
+        if not content or len(content) > self.max_bytes:
+            return
+        digest = get_content_digest(content)
+        with self.lock:
+            self._begin()
+            if self.conn.execute("SELECT 1 FROM bodies WHERE digest = ?", (digest,)).fetchone() == None:
+                self.clock += 1
+                self.conn.execute(
+                    "INSERT INTO bodies (digest, content, size, used) VALUES (?, ?, ?, ?)",
+                    (digest, content, len(content), self.clock))
+                self.total_bytes += len(content)
+                self._evict()
+            else:
+                self._touch(digest)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (urlhash, url, status, content_type, digest) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self._key(urlhash), resp.url, resp.status, resp.content_type, digest))
+            self._sync()
+
+    def get_analysis(self, digest):
+        #the analyzed page stored for a body, or None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT analysis FROM bodies WHERE digest = ?", (digest,)).fetchone()
+        if row == None or row[0] == None:
+            return None
+        return json.loads(row[0])
+
+    def put_analysis(self, digest, page) -> None:
+        #only bodies that are stored keep an analysis, so eviction drops both together
+        with self.lock:
+            self._begin()
+            self.conn.execute(
+                "UPDATE bodies SET analysis = ? WHERE digest = ?", (json.dumps(page), digest))
+            self._sync()
+
+    def _evict(self):
+        #drop the least recently used bodies until the store fits in max_bytes
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT digest, size FROM bodies ORDER BY used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for digest, size in rows:
+                self.conn.execute("DELETE FROM bodies WHERE digest = ?", (digest,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def _sync(self, force=False):
+        #group commit, as in FrontierStore
+        if not self.in_transaction:
+            return
+        now = time.time()
+        if force or now - self.last_commit >= self.durability_interval:
+            self.conn.execute("COMMIT")
+            self.in_transaction = False
+            self.last_commit = now
+
+    def close(self):
+        with self.lock:
+            self._sync(force=True)
+            #pages whose body was evicted are only dropped here, off the crawl path
+            self.conn.execute(
+                "DELETE FROM pages WHERE digest NOT IN (SELECT digest FROM bodies)")
+            self.conn.close()
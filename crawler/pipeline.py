@@ -0,0 +1,211 @@
+import os
+import time
+
+from threading import Thread, Event
+from queue import Queue, Empty
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from utils.download import download
+from utils import get_logger, metrics
+import scraper
+
+from crawler import Crawler
+
+
+class DownloadWorker(Thread):
+    ''' Downloads pages and hands the raw responses to the parse stage.
+    Blocks on the bounded queue when the parse stage falls behind. '''
+
+    def __init__(self, worker_id, config, frontier, responses, wakeup):
+        self.logger = get_logger(f"Worker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        self.responses = responses
+        self.wakeup = wakeup
+        super().__init__(daemon=True)
+
+    def run(self):
+        while True:
+            with metrics.timer('frontier.wait'):
+                tbd_url = self.frontier.get_tbd_url()
+            if not tbd_url:
+                self.logger.info("Frontier is empty. Stopping Crawler.")
+                break
+            resp = self.frontier.stored_response(tbd_url)
+            if resp == None:
+                start = time.perf_counter()
+                with metrics.timer('download'):
+                    resp = download(tbd_url, self.config, self.logger)
+                metrics.count('pages_downloaded')
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                #a failed fetch may go back in the frontier to be retried after its host backs off
+                if self.frontier.record_fetch(tbd_url, resp, time.perf_counter() - start):
+                    continue
+                self.frontier.store_response(tbd_url, resp)
+            else:
+                self.logger.info(f"Reused stored page for {tbd_url}.")
+            #time blocked here means the parse stage is the bottleneck
+            with metrics.timer('pipeline.queue_put'):
+                self.responses.put((tbd_url, resp))
+            self.wakeup.set()
+
+
+def _resolved(page):
+    #a page that needs no parse process, queued with the parses to keep their order
+    future = Future()
+    future.set_result(page)
+    return future
+
+
+class Aggregator(Thread):
+    ''' Sends raw pages to a pool of parse processes and applies their results.
+
+    This is the only thread that updates Stats and adds urls to the Frontier.
+    Results are applied in the order the responses were taken off the queue,
+    so near duplicates are resolved the same way whichever parse ends first.
+    At most max_in_flight pages are parsing or waiting to be applied; past
+    that it stops taking responses off the queue, which in turn blocks the
+    download workers. A page that fails anywhere on the way is logged and
+    still marked complete. '''
+
+    def __init__(self, config, frontier, stats, responses, wakeup, processes):
+        self.logger = get_logger("Aggregator", "Worker")
+        self.config = config
+        self.frontier = frontier
+        self.stats = stats
+        self.responses = responses
+        #set whenever a response is queued or a parse finishes
+        self.wakeup = wakeup
+        self.processes = processes
+        self.max_in_flight = 2 * processes
+        self.in_flight = dict()
+        self.backup_counter = 0
+        super().__init__(daemon=True)
+
+    def run(self):
+        #the parse processes need the same parser and url filter settings
+        with ProcessPoolExecutor(
+                self.processes, initializer=scraper.configure, initargs=(self.config,)) as pool:
+            #future -> (url it is parsing, digest of its body, status), in the order taken
+            in_flight = self.in_flight
+            finished = False
+            while not finished or in_flight:
+                self.wakeup.clear()
+                #apply the parses that are done up to the first one that is not,
+                #hosts only become ready again once applied
+                for future in list(in_flight):
+                    if not future.done():
+                        break
+                    tbd_url, digest, status = in_flight.pop(future)
+                    self._apply(tbd_url, future, digest, status)
+                if not finished and len(in_flight) < self.max_in_flight:
+                    try:
+                        item = self.responses.get_nowait()
+                    except Empty:
+                        item = False
+                    if item == None:
+                        finished = True
+                        continue
+                    if item:
+                        tbd_url, resp = item
+                        try:
+                            future, digest = self._submit(pool, resp)
+                        except Exception as e:
+                            self.logger.error(f"Failed to send {tbd_url} to be parsed: {e!r}")
+                            future, digest = _resolved(None), None
+                        in_flight[future] = (tbd_url, digest, resp.status)
+                        continue
+                self.wakeup.wait(1.0)
+
+    def _submit(self, pool, resp):
+        #status, size and content type checks, the body is already truncated to its limit
+        content = scraper.response_body(resp)
+        if content == None:
+            return _resolved(None), None
+        if not content:
+            #skipped for its size or type, it still counts as a unique page
+            return _resolved(scraper.empty_page(resp.url)), None
+        digest = None
+        if self.frontier.pages != None:
+            #byte identical pages are not sent to a parse process at all
+            digest, page = scraper.lookup_analysis(resp, self.frontier.pages)
+            if page != None:
+                return _resolved(page), None
+        #only the url and the bytes cross the process boundary
+        future = pool.submit(scraper.analyze_page, resp.url, content)
+        future.add_done_callback(lambda future: self.wakeup.set())
+        return future, digest
+
+    def _result(self, tbd_url, future):
+        #a page that fails to parse is still marked complete so its host is not stuck
+        try:
+            return future.result()
+        except Exception as e:
+            self.logger.error(f"Failed to analyze {tbd_url}: {e!r}")
+            return None
+
+    def _apply(self, tbd_url, future, digest, status):
+        page = self._result(tbd_url, future)
+        if digest != None and page != None:
+            try:
+                self.frontier.pages.put_analysis(digest, page)
+            except Exception as e:
+                self.logger.error(f"Failed to store the analysis of {tbd_url}: {e!r}")
+        try:
+            self._finish(tbd_url, page, status)
+        except Exception as e:
+            #an exception here would stop the only thread that applies pages and join would hang
+            self.logger.error(f"Failed to apply {tbd_url}: {e!r}")
+
+    def _finish(self, tbd_url, page, status):
+        new_links = 0
+        try:
+            #the parse itself runs in another process, its stage timers are not collected
+            with metrics.timer('scraper.apply'):
+                scraped_urls = scraper.apply_page(page, self.stats, self.frontier, tbd_url, status)
+            with metrics.timer('frontier.add_url'):
+                for scraped_url in scraped_urls:
+                    new_links += self.frontier.add_url(scraped_url, tbd_url)
+        finally:
+            #the url is complete either way, or its host would never be ready again
+            with metrics.timer('frontier.complete'):
+                self.frontier.mark_url_complete(tbd_url, new_links)
+        #backup the stats and simhashes to local files after every ten pages
+        if self.backup_counter >= 10:
+            with metrics.timer('checkpoint.submit'):
+                #the frontier commits first, the checkpoints cover only completed pages
+                self.frontier.save_simhash_index()
+                self.stats.save_stats()
+            self.backup_counter = 0
+        else:
+            self.backup_counter += 1
+
+
+class PipelineCrawler(Crawler):
+    ''' Download threads -> bounded queue -> parse processes -> one aggregator. '''
+
+    def start_async(self):
+        processes = self.config.parse_processes or os.cpu_count() or 1
+        self.responses = Queue(maxsize=self.config.pipeline_queue)
+        self.wakeup = Event()
+        self.aggregator = Aggregator(
+            self.config, self.frontier, self.stats, self.responses, self.wakeup, processes)
+        self.aggregator.start()
+        metrics.gauge('pipeline_queue_depth', self.responses.qsize)
+        metrics.gauge('pipeline_parsing', lambda: len(self.aggregator.in_flight))
+        self.workers = [
+            DownloadWorker(worker_id, self.config, self.frontier, self.responses, self.wakeup)
+            for worker_id in range(self.config.threads_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def join(self):
+        #download workers only stop once every page has been applied
+        for worker in self.workers:
+            worker.join()
+        self.responses.put(None)
+        self.wakeup.set()
+        self.aggregator.join()
+        super().join()
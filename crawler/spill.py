@@ -0,0 +1,95 @@
+import os
+import shutil
+import struct
+
+#depth, base score and url length of one record, followed by the url
+RECORD = struct.Struct('<IdI')
+
+
+class SpillQueue(object):
+    ''' First in first out queue of (url, depth, base) records in segment
+    files on disk, for the urls that do not fit in the frontier's in-memory
+    window.
+
+    Records are appended to the newest segment and read back from the oldest
+    one, both sequentially through buffered files, so memory use does not
+    depend on how many urls are spilled. A segment is deleted once it has
+    been read. The save file holds every pending url as well, so the segments
+    are never synced: the frontier clears them on startup and spills again
+    from the save file. '''
+
+    def __init__(self, directory, segment_records=100000):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.segments = list()
+        self.count = 0
+        self.writer = None
+        self.written = 0
+        self.reader = None
+        self.clear()
+
+    def __len__(self):
+        return self.count
+
+    def clear(self) -> None:
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.segments = list()
+        self.count = 0
+        self.next_segment = 0
+
+    def _rotate(self):
+        #close the segment being written, the next push starts a new one
+        if self.writer != None:
+            self.writer.close()
+            self.writer = None
+
+    def push(self, url: str, depth: int, base: float) -> None:
+        if self.writer == None or self.written >= self.segment_records:
+            self._rotate()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.next_segment:08d}.seg")
+            self.next_segment += 1
+            self.segments.append(path)
+            self.writer = open(path, 'wb', buffering=1 << 20)
+            self.written = 0
+        encoded = url.encode('utf-8')
+        self.writer.write(RECORD.pack(depth, base, len(encoded)))
+        self.writer.write(encoded)
+        self.written += 1
+        self.count += 1
+
+    def pop_batch(self, size: int) -> list:
+        #up to size of the oldest records
+        batch = list()
+        while len(batch) < size and self.count > 0:
+            if self.reader == None:
+                if self.writer != None and self.segments[0] == self.writer.name:
+                    #the oldest segment is still being written, finish it first
+                    self._rotate()
+                self.reader = open(self.segments[0], 'rb', buffering=1 << 20)
+            header = self.reader.read(RECORD.size)
+            if len(header) < RECORD.size:
+                #segment done
+                self.reader.close()
+                self.reader = None
+                os.remove(self.segments.pop(0))
+                continue
+            depth, base, length = RECORD.unpack(header)
+            batch.append((self.reader.read(length).decode('utf-8'), depth, base))
+            self.count -= 1
+        if self.count == 0 and self.reader != None:
+            #the last segment may still be open for writing, nothing is left in it
+            self.reader.close()
+            self.reader = None
+            self._rotate()
+            for path in self.segments:
+                os.remove(path)
+            self.segments = list()
+        return batch
+
+    def close(self) -> None:
+        self._rotate()
+        if self.reader != None:
+            self.reader.close()
+            self.reader = None
@@ -0,0 +1,164 @@
+import os
+import time
+import uuid
+import sqlite3
+
+from utils.urlset import BloomFilter
+
+
+class FrontierStore(object):
+    ''' SQLite (WAL mode) backing store for the frontier.
+
+    Writes go into one open transaction that is committed at most once every
+    durability_interval seconds (group commit) instead of flushing the whole
+    file for every url. SQLite keeps the file crash consistent, a crash only
+    loses the pages completed since the last commit and those are simply
+    downloaded again on restart.
+
+    Urls are keyed by their 8 byte fingerprint, stored as the integer rowid.
+    An optional in-memory Bloom filter of every key answers most lookups for
+    new urls without touching the database. A clean close saves its bits next
+    to the database so a restart does not rescan every key; after a crash the
+    saved bits may be stale and the filter is rebuilt from the keys.
+
+    A partial index over the urls not completed yet lets a restart read only
+    the pending urls, however many have been crawled. Each url keeps its crawl
+    depth and base priority score, so a restart resumes in the same order. '''
+
+    def __init__(self, path, durability_interval, bloom_capacity=0):
+        self.path = path
+        self.durability_interval = durability_interval
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        #with WAL, NORMAL only syncs on checkpoints and is still crash safe
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS frontier ("
+            "urlhash INTEGER PRIMARY KEY, url TEXT NOT NULL, completed INTEGER NOT NULL, "
+            "depth INTEGER NOT NULL DEFAULT 0, base REAL NOT NULL DEFAULT 0)")
+        #save files from before priority scheduling have neither column
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(frontier)")}
+        for column, declaration in (('depth', 'INTEGER'), ('base', 'REAL')):
+            if column not in columns:
+                self.conn.execute(
+                    f"ALTER TABLE frontier ADD COLUMN {column} {declaration} NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS pending ON frontier (urlhash) WHERE completed = 0")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.in_transaction = False
+        self.last_commit = time.time()
+        self.bloom = None
+        if bloom_capacity > 0:
+            self.bloom = BloomFilter(bloom_capacity)
+            self._load_bloom()
+
+    def _load_bloom(self):
+        #the token is only in the database while the saved bits match it, i.e. between a clean close and the next open
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'bloom'").fetchone()
+        self.conn.execute("DELETE FROM meta WHERE key = 'bloom'")
+        if row != None and self.bloom.read(f"{self.path}.bloom", row[0]):
+            return
+        self.bloom.update(
+            key & 0xffffffffffffffff for (key,) in self.conn.execute("SELECT urlhash FROM frontier"))
+
+    @staticmethod
+    def _key(urlhash):
+        #sqlite integers are signed 64 bit
+        return urlhash - (1 << 64) if urlhash >= (1 << 63) else urlhash
+
+    @staticmethod
+    def remove(path):
+        #delete the database along with its write-ahead log files
+        for file in (path, f"{path}-wal", f"{path}-shm", f"{path}.bloom"):
+            if os.path.exists(file):
+                os.remove(file)
+
+    def _begin(self):
+        if not self.in_transaction:
+            self.conn.execute("BEGIN")
+            self.in_transaction = True
+
+    def __contains__(self, urlhash):
+        if self.bloom != None and urlhash not in self.bloom:
+            #never added, no need to ask the database
+            return False
+        row = self.conn.execute(
+            "SELECT 1 FROM frontier WHERE urlhash = ?", (self._key(urlhash),)).fetchone()
+        return row != None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+    def __bool__(self):
+        return self.conn.execute("SELECT 1 FROM frontier LIMIT 1").fetchone() != None
+
+    def __setitem__(self, urlhash, value):
+        #value is (url, completed) or (url, completed, depth, base)
+        url, completed = value[:2]
+        depth, base = value[2:] or (0, 0.0)
+        self._begin()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO frontier (urlhash, url, completed, depth, base) VALUES (?, ?, ?, ?, ?)",
+            (self._key(urlhash), url, int(completed), depth, base))
+        if self.bloom != None:
+            self.bloom.add(urlhash)
+
+    def values(self):
+        for url, completed in self.conn.execute("SELECT url, completed FROM frontier"):
+            yield url, bool(completed)
+
+    def pending(self):
+        #(url, depth, base) of the urls not completed yet, read through the partial index
+        yield from self.conn.execute(
+            "SELECT url, depth, base FROM frontier INDEXED BY pending WHERE completed = 0")
+
+    def rekey(self, key):
+        #keys every url again with key(url), urls that now share a key keep one row, completed if either was
+        changes = list()
+        for urlhash, url in self.conn.execute("SELECT urlhash, url FROM frontier"):
+            new = self._key(key(url))
+            if new != urlhash:
+                changes.append((urlhash, new))
+        self._begin()
+        for urlhash, new in changes:
+            moved = self.conn.execute(
+                "UPDATE OR IGNORE frontier SET urlhash = ? WHERE urlhash = ?", (new, urlhash)).rowcount
+            if not moved:
+                self.conn.execute(
+                    "UPDATE frontier SET completed = MAX(completed, "
+                    "(SELECT completed FROM frontier WHERE urlhash = ?)) WHERE urlhash = ?", (urlhash, new))
+                self.conn.execute("DELETE FROM frontier WHERE urlhash = ?", (urlhash,))
+            if self.bloom != None:
+                self.bloom.add(new & 0xffffffffffffffff)
+        return len(changes)
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row != None else None
+
+    def set_meta(self, key, value):
+        self._begin()
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def commit_due(self) -> bool:
+        #whether sync() would commit now, so callers can add to the commit first
+        return self.in_transaction and time.time() - self.last_commit >= self.durability_interval
+
+    def sync(self, force=False):
+        #group commit: only hit the disk once the durability interval has passed
+        if not self.in_transaction:
+            return
+        now = time.time()
+        if force or now - self.last_commit >= self.durability_interval:
+            self.conn.execute("COMMIT")
+            self.in_transaction = False
+            self.last_commit = now
+
+    def close(self):
+        self.sync(force=True)
+        if self.bloom != None:
+            #save the bits first, the token only goes in once they are on disk
+            token = uuid.uuid4().hex
+            self.bloom.write(f"{self.path}.bloom", token)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bloom', ?)", (token,))
+        self.conn.close()
@@ -1,10 +1,11 @@
+import time
+
 from threading import Thread
 
 from inspect import getsource
 from utils.download import download
-from utils import get_logger
+from utils import get_logger, metrics
 import scraper
-import time
 import stats
 
 
@@ -14,6 +15,8 @@ class Worker(Thread):
         self.config = config
         self.frontier = frontier
         self.stats = stats
+        #this worker's stats, merged into the shared stats at every backup
+        self.shard = stats.shard()
         self.backup_counter = 0
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests from scraper.py"
@@ -26,22 +29,41 @@ class Worker(Thread):
         while True:
             #backup the stats and simhashes to local files after every ten runs
             if self.backup_counter >= 10:
-                self.stats.save_stats()
-                self.frontier.save_simhash_index()
+                with metrics.timer('checkpoint.submit'):
+                    #the frontier commits first, the checkpoints cover only completed pages
+                    self.frontier.save_simhash_index()
+                    self.stats.save_stats(self.shard)
                 self.backup_counter = 0
             else:
                 self.backup_counter += 1
 
-            tbd_url = self.frontier.get_tbd_url()
+            #time spent here is the politeness delay, or an empty frontier
+            with metrics.timer('frontier.wait'):
+                tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp, self.stats, self.frontier)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            resp = self.frontier.stored_response(tbd_url)
+            if resp == None:
+                start = time.perf_counter()
+                with metrics.timer('download'):
+                    resp = download(tbd_url, self.config, self.logger)
+                metrics.count('pages_downloaded')
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                #a failed fetch may go back in the frontier to be retried after its host backs off
+                if self.frontier.record_fetch(tbd_url, resp, time.perf_counter() - start):
+                    continue
+                self.frontier.store_response(tbd_url, resp)
+            else:
+                self.logger.info(f"Reused stored page for {tbd_url}.")
+            with metrics.timer('scraper'):
+                scraped_urls = scraper.scraper(tbd_url, resp, self.shard, self.frontier)
+            new_links = 0
+            with metrics.timer('frontier.add_url'):
+                for scraped_url in scraped_urls:
+                    new_links += self.frontier.add_url(scraped_url, tbd_url)
+            #the frontier keeps the politeness delay per host, so no sleep here
+            with metrics.timer('frontier.complete'):
+                self.frontier.mark_url_complete(tbd_url, new_links)
@@ -4,23 +4,41 @@ from argparse import ArgumentParser
 from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
+from crawler.async_worker import AsyncWorker
+from crawler.pipeline import PipelineCrawler
+from crawler.frontier import Frontier
+from crawler.cluster import ClusterFrontier
 import stats
 
 
-def main(config_file, restart):
+def main(config_file, restart, node_id=None):
     cparser = ConfigParser()
     cparser.read(config_file)
+    if node_id != None:
+        cparser["CLUSTER"]["NODEID"] = str(node_id)
     config = Config(cparser)
     config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
+    #with more than one node each crawler owns the shard of the hosts hashed to it
+    frontier_factory = ClusterFrontier if len(config.peers) > 1 else Frontier
+    if config.mode == "async":
+        crawler = Crawler(config, restart, frontier_factory=frontier_factory, worker_factory=AsyncWorker)
+    elif config.mode == "pipeline":
+        crawler = PipelineCrawler(config, restart, frontier_factory=frontier_factory)
+    else:
+        crawler = Crawler(config, restart, frontier_factory=frontier_factory)
     crawler.start()
     #after the crawler finishes, write the report to a text file
-    crawler.stats.write_report('report.txt')
+    if len(config.peers) > 1:
+        #node 0 merges the stats of every node into one report
+        crawler.frontier.write_report(crawler.stats, 'report.txt')
+    else:
+        crawler.stats.write_report('report.txt')
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--node_id", type=int, default=None)
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.node_id)
@@ -1,12 +1,59 @@
 import re
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from collections import Counter
+
+from utils.simhash import compute_simhash
+from utils.html_parse import parse_page, get_backend
+from utils.url_filter import UrlFilter
+from utils import metrics, get_content_digest
+from utils.crawllog import SKIPPED, LOW_INFO, DUPLICATE, KEPT
 
 import stats
 
+#html parser and url filter settings, configure() replaces them with the values from config.ini
+parser_backend = get_backend('auto')
+max_page_bytes = 0
+url_filter = UrlFilter()
+#content type -> byte limit (0 for none) of the bodies that are parsed, other types are skipped
+content_types = {'text/html': 0, 'application/xhtml+xml': 0, 'text/plain': 0}
+max_response_bytes = 0
+
+#stop words are not counted in common words, a frozenset so each lookup is one hash
+_stop_words = ['a', 'about', 'above', 'after', 'again', 'against', 'all', 'am', 'an', 'and']
+_stop_words += ['any', 'are', "aren't", 'as', 'at', 'be', 'because', 'been', 'before', 'being']
+_stop_words += ['below', 'between', 'both', 'but', 'by', "can't", 'cannot', 'could', "couldn't", 'did']
+_stop_words += ["didn't", 'do', 'does', "doesn't", 'doing', "don't", 'down', 'during', 'each', 'few']
+_stop_words += ['for', 'from', 'further', 'had', "hadn't", 'has', "hasn't", 'have', "haven't", 'having']
+_stop_words += ['he', "he'd", "he'll", "he's", 'her', 'here', "here's", 'hers', 'herself', 'him']
+_stop_words += ['himself', 'his', 'how', "how's", 'i', "i'd", "i'll", "i'm", "i've", 'if']
+_stop_words += ['in', 'into', 'is', "isn't", 'it', "it's", 'its', 'itself', "let's", 'me']
+_stop_words += ['more', 'most', "mustn't", 'my', 'myself', 'no', 'nor', 'not', 'of', 'off']
+_stop_words += ['on', 'once', 'only', 'or', 'other', 'ought', 'our', 'ours', 'ourselves', 'out']
+_stop_words += ['over', 'own', 'same', "shan't", 'she', "she'd", "she'll", "she's", 'should', "shouldn't"]
+_stop_words += ['so', 'some', 'such', 'than', 'that', "that's", 'the', 'their', 'theirs', 'them']
+_stop_words += ['themselves', 'then', 'there', "there's", 'these', 'they', "they'd", "they'll", "they're", "they've"]
+_stop_words += ['this', 'those', 'through', 'to', 'too', 'under', 'until', 'up', 'very', 'was']
+_stop_words += ["wasn't", 'we', "we'd", "we'll", "we're", "we've", 'were', "weren't", 'what', "what's"]
+_stop_words += ['when', "when's", 'where', "where's", 'which', 'while', 'who', "who's", 'whom', 'why']
+_stop_words += ["why's", 'with', "won't", 'would', "wouldn't", 'you', "you'd", "you'll", "you're", "you've"]
+_stop_words += ['your', 'yours', 'yourself', 'yourselves']
+STOP_WORDS = frozenset(_stop_words)
+del _stop_words
+
+#runs of english letters and digits, everything else separates tokens
+TOKEN_RE = re.compile(r'[a-z0-9]+', re.ASCII)
+
+def configure(config) -> None:
+    global parser_backend, max_page_bytes, url_filter, content_types, max_response_bytes
+    parser_backend = get_backend(config.parser)
+    max_page_bytes = config.max_page_bytes
+    url_filter = UrlFilter(config.domains)
+    content_types = config.content_types
+    max_response_bytes = config.max_response_bytes
+
 def scraper(url, resp, stats, frontier):
-    links = extract_next_links(url, resp, stats, frontier)
-    return [link for link in links if is_valid(link)]
+    #extract_next_links only returns links that already passed is_valid
+    return extract_next_links(url, resp, stats, frontier)
 
 def extract_next_links(url, resp, stats, frontier):
     # Implementation required.
@@ -18,208 +65,178 @@ def extract_next_links(url, resp, stats, frontier):
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
-
-    links = []
+    #frontiers without a page store parse every page
+    return apply_page(analyze_response(resp, getattr(frontier, 'pages', None)), stats, frontier, url, resp.status)
+
+def analyze_response(resp, pages=None):
+    content = response_body(resp)
+    if content == None:
+        return None
+    if not content:
+        return empty_page(resp.url)
+    if pages == None:
+        return analyze_page(resp.url, content)
+    digest, page = lookup_analysis(resp, pages)
+    if page == None:
+        page = analyze_page(resp.url, content)
+        pages.put_analysis(digest, page)
+    return page
+
+def lookup_analysis(resp, pages) -> tuple:
+    # Returns (digest of the body, analysis of a byte identical body or None).
+    # A hit is a mirror, a print view or a page crawled before, it is not parsed
+    # again and keeps the simhash and links found the first time.
+    digest = get_content_digest(resp.raw_response.content)
+    page = pages.get_analysis(digest)
+    if page != None:
+        metrics.count('pages_exact_duplicate')
+        page['url'] = resp.url.split('#', 1)[0]
+    return digest, page
+
+def response_body(resp, count=True):
+    # The part of a response worth parsing, or None to skip it. A reply skipped
+    # for its size or content type gives b'', it is not parsed but still counts
+    # as a unique page, see empty_page. count=False leaves the skips out of the
+    # metrics, for a second look at a response the scraper also checks.
     #check response status first, if not in good range, do not crawl or process
     if (resp.status < 200 or resp.status > 299):
-        return links
+        return None
+
+    #skip huge replies by their size alone, before they are unpickled
+    if max_response_bytes > 0 and resp.size > max_response_bytes:
+        if count:
+            metrics.count('pages_skipped_size')
+        return b''
 
     #check for dead url that return a 200 status but no data
-    if resp.raw_response == None:
-        return links
-    
-    #defragment the url and add to set of unique pages
-    home_url = resp.url.split('#', 1)[0]
-    stats.add_unique_page(home_url)
-
-    #parse url and add it to ics subdomain stats if it is in the ics domain
+    if resp.raw_response == None or resp.raw_response.content == None:
+        return None
+
+    #only parse the configured content types, a page without one is parsed as html
+    content_type = resp.content_type
+    if content_type and content_type not in content_types:
+        if count:
+            metrics.count('pages_skipped_type')
+        return b''
+    content = resp.raw_response.content
+    limit = content_types.get(content_type, 0)
+    if limit > 0 and len(content) > limit:
+        content = content[:limit]
+    return content
+
+def empty_page(resp_url: str) -> dict:
+    # The analysis of a page with nothing to parse: low info, no links.
+    #defragment the url
+    home_url = resp_url.split('#', 1)[0]
+    return {'url': home_url, 'low_info': True, 'simhash': 0, 'links': [], 'words': {}, 'length': 0}
+
+def analyze_page(resp_url: str, content: bytes) -> dict:
+    # The CPU heavy half of extract_next_links. It does not touch stats or the
+    # frontier, so it can run in another process; apply_page does the rest.
+    page = empty_page(resp_url)
+
+    #parse the HTML in a single pass, getting the visible text and the hrefs together
+    with metrics.timer('scraper.parse'):
+        text, hrefs = parse_page(content, parser_backend, max_page_bytes)
+
+    #one sweep gives the token frequencies, the common words and the word count for the low info check
+    with metrics.timer('scraper.tokenize'):
+        frequencies, words, word_like, length = scan_tokens(text)
+    #a page is low info if it has less than 10 words (word-like phrases)
+    if word_like < 10:
+        return page
+    page['low_info'] = False
+
+    #calculate simhash value for page content, weighted by the token frequencies
+    with metrics.timer('scraper.simhash'):
+        page['simhash'] = compute_simhash(frequencies)
+
+    #get the links and process the text, they are only used if the page is not a duplicate
+    for link in url_filter.filter_links(hrefs):
+        link_defragment = link.split('#', 1)[0]
+        #skip evoke pages and comment reply links, both have to be absent
+        if 'evoke.ics.uci.edu' not in link_defragment and 'replytocom' not in link_defragment:
+            if len(link_defragment) < 150:
+                page['links'].append(link_defragment)
+
+    page['words'] = words
+    page['length'] = length
+    return page
+
+def apply_page(page: dict, stats, frontier, url: str = None, status: int = 0) -> list:
+    # Records an analyzed page in stats and the frontier, returns its links.
+    # url is the url that was fetched, the trap detector counts the page under it.
+    # Every page, parsed or not, also goes to the crawl log with its status.
+    if page == None:
+        if url != None:
+            stats.record_page(url, None, status, SKIPPED)
+        return []
+    fetched_url = url if url != None else page['url']
+
+    #parse url to find its ics subdomain, if it is in the ics domain
+    home_url = page['url']
     parsed = urlparse(home_url)
+    subdomain_url = None
     if re.search(r'\.ics\.uci\.edu', parsed.netloc) != None:
         subdomain_url = f'{parsed.scheme}://{parsed.netloc}'
-        stats.add_ics_subdomain(subdomain_url, home_url)
-
-    #use beautiful soup to parse the HTML
-    soup = BeautifulSoup(resp.raw_response.content, 'html.parser')
-    text = soup.get_text()
-
-    #tokenize text and do not crawl if the page is low info
-    tokens = tokenize(text)
-    if detect_low_info(tokens) == True:
-        return links
-
-    #calculate simhash value for page content and check similarity
-    simhash = get_simhash(tokens)
-    if detect_duplicate(simhash, frontier, 0.95) == True:
-        return links
-    else:
-        frontier.add_simhash_index(simhash)
 
-    #if page is good to crawl, get the links and process the text
-    for link in soup.find_all('a'):
-        link = link.get('href')
-        if (is_valid(link)):
-            link_defragment = link.split('#', 1)[0]
-            if re.search(r'evoke.ics.uci.edu', link_defragment) == None or re.search(r'replytocom', link_defragment) == None:
-                if len(link_defragment) < 150:
-                    links.append(link_defragment)
-
-    process_text(tokens, home_url, stats)
-
-    return links
+    #add to set of unique pages, a new page is counted in its ics subdomain
+    stats.add_unique_page(home_url, subdomain_url)
+
+    #do not crawl if the page is low info
+    if page['low_info'] == True:
+        metrics.count('pages_low_info')
+        frontier.record_page(fetched_url, 'low_info')
+        stats.record_page(home_url, subdomain_url, status, LOW_INFO, page['length'])
+        return []
+
+    #the frontier only keeps the simhash if no near duplicate is indexed
+    with metrics.timer('scraper.dedupe'):
+        unique = frontier.add_simhash_index(page['simhash'], fetched_url)
+    if unique == False:
+        metrics.count('pages_near_duplicate')
+        frontier.record_page(fetched_url, 'duplicate')
+        stats.record_page(home_url, subdomain_url, status, DUPLICATE, page['length'], page['simhash'])
+        return []
+    frontier.record_page(fetched_url, 'kept')
+    stats.record_page(home_url, subdomain_url, status, KEPT, page['length'], page['simhash'], page['words'])
+
+    #if page is good to crawl, count its words and return the links
+    with metrics.timer('stats.words'):
+        stats.add_common_words(page['words'])
+    #all tokens go into the longest page stat
+    stats.change_longest_page(home_url, page['length'])
+    metrics.count('links_found', len(page['links']))
+    return page['links']
 
 
 def is_valid(url) -> bool:
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
     # There are already some conditions that return False.
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        #see if url matches the wanted domains using regular expressions
-        if re.search(r'(\.ics\.uci\.edu)|(\.cs\.uci\.edu)|(\.informatics\.uci\.edu)|(\.stat\.uci\.edu)|(today\.uci\.edu)', parsed.netloc) == None:
-            return False
-        if re.search(r'today\.uci\.edu', parsed.netloc) != None:
-            if re.search(r'/department/information_computer_sciences', parsed.path) == None:
-                return False
-        
-        return not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", parsed.path.lower())
-
-    except TypeError:
-        print ("TypeError for ", url)
-        raise
+    # The domain, path and extension rules live in the configured UrlFilter,
+    # which memoizes its verdicts.
+    return url_filter.is_valid(url)
 
 
 def tokenize(text: str) -> list:
-    tokens = []
-    #use regular expressions to slip line by any non English alphanumeric char (special, whitespace, etc)
-    words = re.split(r'[^a-zA-Z0-9]+', text.lower().strip(), flags = re.ASCII)
-    #this if else statement is instead of checking each word
-    #gets rid of empty line token
-    if len(words) == 1 and words[0] == '':
-        pass
-    #fixes if a line starts and ends with a special char
-    elif words[0] == '' and words[len(words) - 1] == '':
-        tokens += words[1:len(words) - 1]
-    #fixes if a line starts with a special char
-    elif words[0] == '':
-        tokens += words[1:]
-    #fixes if a line ends with a special char
-    elif words[len(words) - 1] == '':
-        tokens += words[:len(words) - 1]
-    #normal add tokens on that line to total token list
-    else:
-        tokens += words
-    return tokens
-
-
-def process_text(tokens: list, url: str, stats) -> None:
-    #list of stop words to not count in common words
-    stop_words = ['a', 'about', 'above', 'after', 'again', 'against', 'all', 'am', 'an', 'and']
-    stop_words += ['any', 'are', "aren't", 'as', 'at', 'be', 'because', 'been', 'before', 'being']
-    stop_words += ['below', 'between', 'both', 'but', 'by', "can't", 'cannot', 'could', "couldn't", 'did']
-    stop_words += ["didn't", 'do', 'does', "doesn't", 'doing', "don't", 'down', 'during', 'each', 'few']
-    stop_words += ['for', 'from', 'further', 'had', "hadn't", 'has', "hasn't", 'have', "haven't", 'having']
-    stop_words += ['he', "he'd", "he'll", "he's", 'her', 'here', "here's", 'hers', 'herself', 'him']
-    stop_words += ['himself', 'his', 'how', "how's", 'i', "i'd", "i'll", "i'm", "i've", 'if']
-    stop_words += ['in', 'into', 'is', "isn't", 'it', "it's", 'its', 'itself', "let's", 'me']
-    stop_words += ['more', 'most', "mustn't", 'my', 'myself', 'no', 'nor', 'not', 'of', 'off']
-    stop_words += ['on', 'once', 'only', 'or', 'other', 'ought', 'our', 'ours', 'ourselves', 'out']
-    stop_words += ['over', 'own', 'same', "shan't", 'she', "she'd", "she'll", "she's", 'should', "shouldn't"]
-    stop_words += ['so', 'some', 'such', 'than', 'that', "that's", 'the', 'their', 'theirs', 'them']
-    stop_words += ['themselves', 'then', 'there', "there's", 'these', 'they', "they'd", "they'll", "they're", "they've"]
-    stop_words += ['this', 'those', 'through', 'to', 'too', 'under', 'until', 'up', 'very', 'was']
-    stop_words += ["wasn't", 'we', "we'd", "we'll", "we're", "we've", 'were', "weren't", 'what', "what's"]
-    stop_words += ['when', "when's", 'where', "where's", 'which', 'while', 'who', "who's", 'whom', 'why']
-    stop_words += ["why's", 'with', "won't", 'would', "wouldn't", 'you', "you'd", "you'll", "you're", "you've"]
-    stop_words += ['your', 'yours', 'yourself', 'yourselves']
-
-    for token in tokens:
-        #only count a token as a common word if it is not a stop word, is more than one character, and has no numbers
-        if token not in stop_words and len(token) > 1 and re.search(r'\d', token) == None:
-            stats.add_common_word(token)
-    #all tokens go into the longest page stat
-    stats.change_longest_page(url, len(tokens))
-
-def detect_duplicate(simhash: str, frontier, threshold: float) -> bool:
-    s1 = int(simhash, 2)
-    #compare the given simhash to all unique simhashes found before
-    for shash in frontier.get_simhash_index():
-        #calculate similar bits in the fingerprints
-        s2 = int(shash, 2)
-        i = s1 ^ s2
-        diff = 0.0
-        while i:
-            i = i & (i-1)
-            diff += 1.0
-        #using 32 bit fingerprints
-        similar = 32.0 - diff
-        #if the number of similar bits divided by total bits is greater than the given threshold, return true
-        if similar/32.0 >= threshold:
-            return True
-    return False
-
-def detect_low_info(tokens: list) -> bool:
-    words = 0
-    #a page is low info if it has less than 10 words (word-like phrases)
-    for token in tokens:
-        if len(token) > 1 and re.search(r'\d', token) == None:
-            words += 1
-        if words >= 10:
-            return False
-    return True
-
-def compute_word_frequencies(token_list: list) -> dict:
-    token_count = dict()
-    for token in token_list:
-        #if the token is already in the dict, add its count +1
-        if token in token_count:
-            token_count[token] += 1
-        #if not, set the count to 1
-        else:
-            token_count[token] = 1
-    return token_count
-
-def get_simhash(tokens: list) -> str:
-    #defining weights as the frequency of the tokens
-    weights = compute_word_frequencies(tokens)
-    binary = dict()
-    #get the 32 bit binary hash for each token
-    for k in weights.keys():
-        binary[k] = hash32b(k)
-    bit = 31
-    fingerprint = ''
-    #go through each bit of each hashed token and calculate the fingerprint based on weights
-    while bit >= 0:
-        vec = 0
-        for k,v in binary.items():
-            if v[bit] == '0':
-                vec -= weights[k]
-            else:
-                vec += weights[k]
-        if vec > 0:
-            fingerprint = '1' + fingerprint
-        else:
-            fingerprint = '0' + fingerprint
-        bit -= 1
-    return fingerprint
-
-def hash32b(token: str) -> str:
-    #use the default python hash function
-    hashint = hash(token)
-    b = 2**32
-    #mod it so can be represented by 32 bits
-    hashbin = f'{hashint % b:b}'
-    #add extra zeros to the front if neccessary
-    while len(hashbin) < 32:
-        hashbin = '0' + hashbin
-    return hashbin
+    #split by any non English alphanumeric char (special, whitespace, etc), findall never yields empty tokens
+    return TOKEN_RE.findall(text.lower())
+
+
+def scan_tokens(text: str) -> tuple:
+    # One sweep over the page text. Returns (frequencies of every token, common
+    # word counts without stop words, number of word-like tokens, token count).
+    # Words are judged once per distinct token instead of once per occurrence.
+    tokens = tokenize(text)
+    frequencies = Counter(tokens)
+    words = dict()
+    word_like = 0
+    for token, count in frequencies.items():
+        #a word is more than one character and has no numbers, tokens only hold letters and digits
+        if len(token) > 1 and token.isalpha():
+            word_like += count
+            if token not in STOP_WORDS:
+                words[token] = count
+    return frequencies, words, word_like, len(tokens)
 
@@ -1,26 +1,245 @@
-import json
+import heapq
+
+from threading import RLock
+from argparse import ArgumentParser
+
+from utils.checkpoint import Checkpointer
+from utils.crawllog import CrawlLog, encode_record, read_records, SKIPPED, KEPT, OUTCOMES
+from utils.topk import SpaceSaving
+from utils.simhash import hash64
+from utils.urlset import FingerprintSet
+
+def page_fingerprint(url: str) -> int:
+    #8 byte fingerprint of the full url (scheme included), never 0
+    return hash64(url) or 1
+
+def empty_stats_state() -> dict:
+    return {'pages': [], 'longest': ['', 0], 'words': {}, 'subdomains': {}}
+
+def stats_word_mode(state: dict) -> str:
+    #states name how their words are counted, a word counted in exact mode can
+    #have any name. States saved before the tag are told apart by their keys
+    mode = state.get('word_mode')
+    if mode == None:
+        words = state['words']
+        mode = 'topk' if 'counts' in words and 'total' in words and 'capacity' in words else 'exact'
+    return mode
+
+def summary_counts(summary: dict) -> dict:
+    #word -> count of a saved heavy hitters summary, which keeps [count, error]
+    return {k: v[0] for k,v in summary['counts'].items()}
+
+def apply_stats_delta(state: dict, delta: dict) -> dict:
+    #merge the changes from one checkpoint into the full stats state
+    if state['pages'] and isinstance(state['pages'][0], str):
+        #older checkpoints stored the full urls, the snapshot keeps fingerprints
+        state['pages'] = [page_fingerprint(page) for page in state['pages']]
+    #pages is a list, or an array of fingerprints when read from a snapshot
+    state['pages'].extend(delta['pages'])
+    if delta['longest'][1] > state['longest'][1]:
+        state['longest'] = delta['longest']
+    if 'summary_changes' in delta:
+        #heavy hitters mode, only the counters that changed since the last checkpoint
+        if stats_word_mode(state) != 'topk':
+            #the crawl went on in topk mode, the first delta holds every counter
+            state['words'] = {'capacity': 0, 'total': 0, 'counts': {}}
+        SpaceSaving.apply_changes(state['words'], delta['summary_changes'])
+        state['word_mode'] = 'topk'
+    elif 'summary' in delta:
+        #older checkpoints held the whole summary in every delta
+        state['words'] = delta['summary']
+        state['word_mode'] = 'topk'
+    else:
+        if stats_word_mode(state) == 'topk':
+            #the crawl went on in exact mode, keep counting from the summary
+            state['words'] = summary_counts(state['words'])
+        state['word_mode'] = 'exact'
+        for k,v in delta['words'].items():
+            state['words'][k] = state['words'].get(k, 0) + v
+    for k,v in delta['subdomains'].items():
+        state['subdomains'][k] = state['subdomains'].get(k, 0) + v
+    return state
+
+class StatsShard:
+    ''' Stats one worker collects between checkpoints, updated without locks.
+
+    Each worker thread owns one shard and folds it into the shared Stats with
+    Stats.save_stats(shard), which takes the union of the pages, the sum of
+    the word counts and the max of the longest page. When the crawl log is
+    on, the shard also buffers the encoded page records until its merge. '''
+
+    def __init__(self, log=False):
+        self._log = log
+        self.clear()
+
+    def clear(self) -> None:
+        #page fingerprint -> its ics subdomain, or None outside ics
+        self._pages = dict()
+        self._longest_page = ['', 0]
+        self._words = dict()
+        self._records = []
+
+    def record_page(self, url: str, subdomain: str, status: int, outcome: int,
+                    length: int = 0, simhash: int = 0, words: dict = None) -> None:
+        #one processed page for the crawl log, outcome is one of utils.crawllog's outcomes
+        if self._log:
+            self._records.append(encode_record(
+                page_fingerprint(url), simhash, status, outcome, length, url, subdomain, words or {}))
+
+    def add_unique_page(self, url: str, subdomain: str = None) -> bool:
+        #returns True if this shard has not seen the page since its last merge,
+        #whether it is new to the whole crawl is only known when it is merged
+        fingerprint = page_fingerprint(url)
+        if fingerprint in self._pages:
+            return False
+        self._pages[fingerprint] = subdomain
+        return True
+
+    def change_longest_page(self, url: str, count: int) -> None:
+        if count > self._longest_page[1]:
+            self._longest_page = [url, count]
+
+    def add_common_word(self, word: str) -> None:
+        self._words[word] = self._words.get(word, 0) + 1
+
+    def add_common_words(self, words: dict) -> None:
+        totals = self._words
+        get_total = totals.get
+        for word, count in words.items():
+            totals[word] = get_total(word, 0) + count
+
+
 
 class Stats:
-    def __init__(self):
+    def __init__(self, config=None, checkpoint=True, logger=None):
+        #checkpoint=False is a Stats rebuilt offline, it neither reads nor writes checkpoints
+        self.logger = logger
+        #exact keeps every word in a dict, topk keeps a fixed size heavy hitters summary
+        self._word_mode = config.word_counts if config != None else 'exact'
+        self._topk_capacity = config.topk_capacity if config != None else 10000
         #keep track of the four stats for the report
-        self._unique_pages = set()
+        #8 byte fingerprints in a flat array instead of a set of url strings
+        self._unique_pages = FingerprintSet()
         self._longest_page = ['', 0]
-        self._words = dict()
+        if self._word_mode == 'topk':
+            self._words = SpaceSaving(self._topk_capacity)
+        else:
+            self._words = dict()
+        #subdomain -> number of unique pages in it
         self._ics_subdomains = dict()
+        #changes since the last checkpoint, only these are written on save_stats
+        self._new_pages = []
+        self._new_words = dict()
+        self._new_subdomains = dict()
+        #merges from the worker threads and checkpoints take turns
+        self._lock = RLock()
+        self._shards = []
+        self._checkpoint = None
+        self._log = None
+        if not checkpoint:
+            return
+        self._checkpoint = Checkpointer(
+            'stats_snapshot.txt', 'stats_log.txt', empty_stats_state, apply_stats_delta,
+            arrays=('pages',))
+        #every processed page is appended to the crawl log, the report can be rebuilt from it
+        if config != None and config.crawl_log:
+            self._log = CrawlLog(config.crawl_log)
         #if continuing a crawler (ex. if it crashes), load stats
         try:
             self.load_stats()
-        except:
-            pass
+        except Exception as e:
+            #start from empty stats rather than not at all, but say so
+            if self.logger != None:
+                self.logger.error(f"Could not load the saved stats, starting from empty stats: {e!r}")
     
-    def add_unique_page(self, url: str) -> None:
-        #adds a url, will only add if unique beacuse it is a set
-        self._unique_pages.add(url)
+    def add_unique_page(self, url: str, subdomain: str = None) -> bool:
+        #adds a url, will only add if unique beacuse it is a set, returns True if it was new
+        #a new page is also counted in its ics subdomain if one is given
+        fingerprint = page_fingerprint(url)
+        if self._unique_pages.add(fingerprint):
+            self._new_pages.append(fingerprint)
+            if subdomain != None:
+                self.add_ics_subdomain(subdomain)
+            return True
+        return False
+
+    def shard(self) -> StatsShard:
+        #a lock free shard for one worker thread, merged in by save_stats(shard) and close
+        shard = StatsShard(log=self._log != None)
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def merge(self, shard: StatsShard) -> None:
+        #fold a shard in and empty it, only call it from the thread that owns the shard
+        with self._lock:
+            for fingerprint, subdomain in shard._pages.items():
+                if self._unique_pages.add(fingerprint):
+                    self._new_pages.append(fingerprint)
+                    if subdomain != None:
+                        self.add_ics_subdomain(subdomain)
+            self.change_longest_page(*shard._longest_page)
+            self.add_common_words(shard._words)
+            if shard._records:
+                self._log.append(shard._records)
+            shard.clear()
+
+    def record_page(self, url: str, subdomain: str, status: int, outcome: int,
+                    length: int = 0, simhash: int = 0, words: dict = None) -> None:
+        #one processed page for the crawl log, see StatsShard.record_page
+        if self._log != None:
+            record = encode_record(
+                page_fingerprint(url), simhash, status, outcome, length, url, subdomain, words or {})
+            with self._lock:
+                self._log.append([record])
+
+    def add_record(self, record) -> None:
+        #rebuild from the crawl log, a page refetched after a crash only counts the first time
+        if record.outcome == SKIPPED or not self._unique_pages.add(record.urlhash):
+            return
+        self._new_pages.append(record.urlhash)
+        if record.subdomain != None:
+            self.add_ics_subdomain(record.subdomain)
+        if record.outcome == KEPT:
+            self.change_longest_page(record.url, record.length)
+            if record.words:
+                self.add_common_words(record.words)
+
+    def to_state(self) -> dict:
+        #the whole stats in checkpoint form, to merge into the stats of another node
+        with self._lock:
+            words = self._words.to_state() if self._word_mode == 'topk' else dict(self._words)
+            return {'pages': list(self._unique_pages), 'longest': list(self._longest_page),
+                    'words': words, 'word_mode': self._word_mode, 'subdomains': dict(self._ics_subdomains)}
+
+    def merge_state(self, state: dict) -> None:
+        #fold in the stats of another node: the union of the pages, the sum of
+        #the word and subdomain counts (nodes crawl disjoint hosts)
+        with self._lock:
+            for fingerprint in state['pages']:
+                if self._unique_pages.add(fingerprint):
+                    self._new_pages.append(fingerprint)
+            self.change_longest_page(*state['longest'])
+            words = state['words']
+            if stats_word_mode(state) == 'topk':
+                if self._word_mode == 'topk':
+                    self._words.merge(SpaceSaving.from_state(words))
+                    words = {}
+                else:
+                    words = summary_counts(words)
+            self.add_common_words(words)
+            for k,v in state['subdomains'].items():
+                self._ics_subdomains[k] = self._ics_subdomains.get(k, 0) + v
+                self._new_subdomains[k] = self._new_subdomains.get(k, 0) + v
 
     def get_unique_pages(self) -> int:
         #return the length of the unique pages set
         return len(self._unique_pages)
 
+    def get_unique_pages_bytes(self) -> float:
+        #memory used by the unique pages set per url
+        return self._unique_pages.bytes_per_item()
+
     def change_longest_page(self, url: str, count: int) -> None:
         #check if the new page is longer, if so update the longest page
         if count > self._longest_page[1]:
@@ -32,34 +251,56 @@ class Stats:
         return self._longest_page
 
     def add_common_word(self, word: str) -> int:
+        if self._word_mode == 'topk':
+            #the summary keeps track of the counters that change, for the next checkpoint
+            self._words.add(word)
+            return
         #add the word to the dictionary and update the value
         if word in self._words:
             self._words[word] += 1
         else:
             self._words[word] = 1
+        if word in self._new_words:
+            self._new_words[word] += 1
+        else:
+            self._new_words[word] = 1
+
+    def add_common_words(self, words: dict) -> None:
+        #add a whole page of word counts at once
+        if self._word_mode == 'topk':
+            for word, count in words.items():
+                self._words.add(word, count)
+            return
+        #one loop over the page's distinct words, with the lookups bound once
+        totals, new_words = self._words, self._new_words
+        get_total, get_new = totals.get, new_words.get
+        for word, count in words.items():
+            totals[word] = get_total(word, 0) + count
+            new_words[word] = get_new(word, 0) + count
 
     def get_common_words(self) -> list:
-        words50 = []
         #get 50 top words sorted by frequency and then alphebetical
-        for k,v in sorted(self._words.items(), key = lambda x: (-x[1], x[0])):
-            if len(words50) < 50:
-                words50.append(k)
-            else:
-                break
-        return words50
+        if self._word_mode == 'topk':
+            return [word for word, count, error in self._words.top(50)]
+        words50 = heapq.nsmallest(50, self._words.items(), key = lambda x: (-x[1], x[0]))
+        return [k for k,v in words50]
 
-    def add_ics_subdomain(self, subdomain_url: str, full_url: str) -> None:
-        #add the url to the ics subdomain dictionary using sets
-        if subdomain_url in self._ics_subdomains:
-            self._ics_subdomains[subdomain_url].add(full_url)
-        else:
-            self._ics_subdomains[subdomain_url] = set(full_url)
+    def get_word_error(self) -> tuple:
+        #total words counted and the most any reported count can be over its true count
+        if self._word_mode == 'topk':
+            return self._words.total, self._words.error_bound()
+        return sum(self._words.values()), 0
+
+    def add_ics_subdomain(self, subdomain_url: str) -> None:
+        #count one more unique page in the subdomain, call it only for pages add_unique_page found new
+        self._ics_subdomains[subdomain_url] = self._ics_subdomains.get(subdomain_url, 0) + 1
+        self._new_subdomains[subdomain_url] = self._new_subdomains.get(subdomain_url, 0) + 1
 
     def get_ics_subdomains(self) -> list:
         subdomains = []
         #get the ics subdomains and number of unique pages in each
         for k,v in sorted(self._ics_subdomains.items(), key = lambda x: x[0]):
-            subdomains.append(f'{k}, {len(v)}')
+            subdomains.append(f'{k}, {v}')
         return subdomains
 
     def display_stats(self) -> str:
@@ -68,6 +309,10 @@ class Stats:
         report += f'Unique pages: {self.get_unique_pages()}\n\n'
         report += f'Longest page: {self.get_longest_page()[0]}, {self.get_longest_page()[1]}\n\n'
         report += '50 most common words (ignoring English stop words):\n'
+        if self._word_mode == 'topk':
+            total, error = self.get_word_error()
+            report += (f'(estimated from {total} words with {self._topk_capacity} counters, '
+                       f'each count is over by at most {error})\n')
         word_rank = 1
         for word in self.get_common_words():
             report += f'{word_rank}. {word}\n'
@@ -92,23 +337,126 @@ class Stats:
             if file != None:
                 file.close()
 
-    def save_stats(self):
-        subdomain_lists = dict()
-        #transform some data from set to list so json will work
-        for k,v in self._ics_subdomains.items():
-            subdomain_lists[k] = list(v)
-        #use json to dump the stats to a local text file for a backup
-        with open('stats_dump.txt', 'w') as file:
-            json.dump([list(self._unique_pages), self._longest_page, self._words, subdomain_lists], file)
+    def save_stats(self, shard: StatsShard = None):
+        #merge the caller's shard, then swap out the changes since the last checkpoint
+        #and let the background writer append them
+        with self._lock:
+            if shard != None:
+                self.merge(shard)
+            delta = {'pages': self._new_pages, 'longest': list(self._longest_page),
+                     'words': self._new_words, 'subdomains': self._new_subdomains}
+            if self._word_mode == 'topk':
+                delta['summary_changes'] = self._words.take_changes()
+            self._new_pages = []
+            self._new_words = dict()
+            self._new_subdomains = dict()
+            if self._checkpoint != None:
+                self._checkpoint.submit(delta)
+            if self._log != None:
+                self._log.flush()
+
+    def close(self):
+        #the workers have stopped, merge what their shards still hold and
+        #wait for the background writer to write the last changes
+        with self._lock:
+            for shard in self._shards:
+                self.merge(shard)
+            self.save_stats()
+            if self._log != None:
+                self._log.close()
+        if self._checkpoint != None:
+            self._checkpoint.close()
 
     def load_stats(self):
-        #use json to load the stats to the latest backup text file
-        with open('stats_dump.txt', 'r') as file:
-            stats = json.load(file)
-        self._unique_pages = set(stats[0])
-        self._longest_page = stats[1]
-        self._words = stats[2]
-        #turn the data from list back into sets
-        for k,v in stats[3].items():
-            self._ics_subdomains[k] = set(v)
+        #rebuild the stats from the latest snapshot plus the checkpoint log
+        stats = self._checkpoint.load()
+        self._unique_pages = FingerprintSet(len(stats['pages']))
+        for page in stats['pages']:
+            #older checkpoints stored the full urls
+            self._unique_pages.add(page_fingerprint(page) if isinstance(page, str) else page)
+        self._longest_page = stats['longest']
+        self._load_words(stats['words'], stats_word_mode(stats))
+        for k,v in stats['subdomains'].items():
+            self._ics_subdomains[k] = len(v) if isinstance(v, list) else v
+
+    def _load_words(self, words: dict, mode: str) -> None:
+        #a summary is saved as {'capacity', 'total', 'counts'}, exact counts as a plain dict
+        summary = mode == 'topk'
+        if self._word_mode == 'topk':
+            if summary:
+                self._words = SpaceSaving.from_state(words, self._topk_capacity)
+            else:
+                self._words = SpaceSaving(self._topk_capacity)
+                for k,v in words.items():
+                    self._words.add(k, v)
+        elif summary:
+            self._words = summary_counts(words)
+        else:
+            self._words = words
+
+
+def build_stats(paths, word_counts='topk', capacity=100000, subdomain=None) -> Stats:
+    # Rebuilds the stats of a crawl from its crawl logs, e.g. the logs of
+    # every node of a multi node crawl. In topk mode memory is bounded by the
+    # capacity and the unique page fingerprints (8 bytes each). subdomain
+    # keeps only the pages of one ics subdomain.
+    config = type('ReportConfig', (), {'word_counts': word_counts, 'topk_capacity': capacity})()
+    stats = Stats(config, checkpoint=False)
+    for path in paths:
+        for count, record in enumerate(read_records(path)):
+            if subdomain == None or record.subdomain == subdomain:
+                stats.add_record(record)
+            if count % 10000 == 0:
+                #without a checkpoint this only drops the changes kept for one
+                stats.save_stats()
+    stats.save_stats()
+    return stats
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Reports and queries over crawl logs (CRAWLLOG in config.ini).")
+    parser.add_argument("command", choices=["report", "words", "subdomains", "outcomes"])
+    parser.add_argument("logs", nargs="+", help="crawl logs, one per node")
+    parser.add_argument("--output", type=str, default=None, help="write the report here instead of printing it")
+    parser.add_argument("--top", type=int, default=50, help="words: how many words to list")
+    parser.add_argument("--subdomain", type=str, default=None,
+                        help="only pages of this ics subdomain, e.g. https://vision.ics.uci.edu")
+    parser.add_argument("--word_counts", type=str, default="topk", choices=["exact", "topk"])
+    parser.add_argument("--capacity", type=int, default=100000, help="word counters kept in topk mode")
+    args = parser.parse_args(argv)
+
+    if args.command == "outcomes":
+        #one pass without decoding the words: pages per outcome and per status
+        outcomes, statuses = dict(), dict()
+        for path in args.logs:
+            for record in read_records(path, words=False):
+                outcome = OUTCOMES[record.outcome]
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                statuses[record.status] = statuses.get(record.status, 0) + 1
+        for outcome, count in sorted(outcomes.items()):
+            print(f'{outcome}, {count}')
+        for status, count in sorted(statuses.items()):
+            print(f'status {status}, {count}')
+        return
+
+    stats = build_stats(args.logs, args.word_counts, args.capacity, args.subdomain)
+    if args.command == "report":
+        if args.output != None:
+            stats.write_report(args.output)
+        else:
+            print(stats.display_stats())
+    elif args.command == "words":
+        if args.word_counts == 'topk':
+            top = stats._words.top(args.top)
+        else:
+            top = [(word, count, 0) for word, count in
+                   heapq.nsmallest(args.top, stats._words.items(), key=lambda x: (-x[1], x[0]))]
+        for rank, (word, count, error) in enumerate(top, 1):
+            print(f'{rank}. {word}, {count}' + (f' (over by at most {error})' if error else ''))
+    elif args.command == "subdomains":
+        for subdomain in stats.get_ics_subdomains():
+            print(subdomain)
+
 
+if __name__ == "__main__":
+    main()
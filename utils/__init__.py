@@ -1,6 +1,6 @@
 import os
 import logging
-from hashlib import sha256
+from hashlib import sha256, blake2b
 from urllib.parse import urlparse
 
 def get_logger(name, filename=None):
@@ -22,6 +22,9 @@ def get_logger(name, filename=None):
     return logger
 
 
+#schemes of the urls get_urlfingerprint splits without urlparse
+_SCHEMES = frozenset(["http", "https", "HTTP", "HTTPS"])
+
 def get_urlhash(url):
     parsed = urlparse(url)
     # everything other than scheme.
@@ -29,6 +32,26 @@ def get_urlhash(url):
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
 
+def get_urlfingerprint(url):
+    #8 byte version of get_urlhash, never 0 so it can mark empty slots in a FingerprintSet
+    scheme, sep, rest = url.partition("://")
+    if (sep and scheme in _SCHEMES and ";" not in rest and "#" not in rest
+            and "\t" not in rest and "\r" not in rest and "\n" not in rest):
+        #the same parts urlparse finds, split by hand for the common url without params or fragment
+        rest, _, query = rest.partition("?")
+        netloc, slash, path = rest.partition("/")
+        key = f"{netloc}/{slash}{path}//{query}/"
+    else:
+        parsed = urlparse(url)
+        key = (f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
+               f"{parsed.query}/{parsed.fragment}")
+    fingerprint = int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return fingerprint or 1
+
+def get_content_digest(content):
+    #16 byte digest of a page body, byte identical pages share it
+    return blake2b(content, digest_size=16).digest()
+
 def normalize(url):
     if url.endswith("/"):
         return url.rstrip("/")
@@ -0,0 +1,123 @@
+import asyncio
+import cbor
+
+from urllib.parse import urlencode
+
+from utils.response import Response
+from utils import metrics
+
+
+class HTTPError(Exception):
+    pass
+
+
+class AsyncDownloader(object):
+    ''' Asyncio client for the cache server with a bounded keep-alive pool.
+
+    At most max_connections requests are in flight at once. Idle connections
+    are kept open and reused, so a fetch only pays the TCP setup when the pool
+    has no idle connection left. Uses plain HTTP/1.1 over asyncio streams. '''
+
+    def __init__(self, config, logger=None, max_connections=None, timeout=None):
+        self.config = config
+        self.logger = logger
+        self.host, self.port = config.cache_server
+        self.max_connections = max_connections or config.max_connections
+        self.timeout = timeout or config.timeout
+        self._idle = list()
+        self._slots = asyncio.Semaphore(self.max_connections)
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        while self._idle:
+            reader, writer = self._idle.pop()
+            #the server may have closed an idle connection in the meantime
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, reusable):
+        if reusable:
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+        self._slots.release()
+
+    async def _read_body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = list()
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    #skip any trailers up to the final blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        return await reader.read()
+
+    async def _get(self, query):
+        reader, writer = conn = await self._acquire()
+        reusable = False
+        try:
+            writer.write(
+                f"GET /?{query} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                f"Connection: keep-alive\r\n\r\n".encode("ascii"))
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise HTTPError("Connection closed by cache server")
+            status = int(status_line.split()[1])
+            headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await self._read_body(reader, headers)
+            reusable = (
+                headers.get("connection", "").lower() != "close"
+                and ("content-length" in headers or "transfer-encoding" in headers))
+            return status, body
+        finally:
+            self._release(conn, reusable)
+
+    async def download(self, url):
+        query = urlencode([("q", f"{url}"), ("u", f"{self.config.user_agent}")])
+        try:
+            status, content = await asyncio.wait_for(self._get(query), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                HTTPError, ValueError, IndexError) as e:
+            return self._error(url, f"Spacetime Response error {e!r} with url {url}.", 600)
+        metrics.count('bytes_downloaded', len(content))
+        try:
+            if content:
+                return Response(cbor.loads(content))
+        except (EOFError, ValueError) as e:
+            pass
+        return self._error(url, f"Spacetime Response error <{status}> with url {url}.", status)
+
+    def _error(self, url, error, status):
+        if self.logger:
+            self.logger.error(error)
+        return Response({
+            "error": error,
+            "status": status,
+            "url": url,
+            "failed": True})
+
+    async def close(self):
+        for reader, writer in self._idle:
+            writer.close()
+        self._idle = list()
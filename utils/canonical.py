@@ -0,0 +1,90 @@
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+from utils import get_urlfingerprint
+
+RULES = ('case', 'port', 'index', 'query', 'params')
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+#last path segments that name the page a directory url serves
+INDEX_PAGES = frozenset([
+    'index.html', 'index.htm', 'index.php', 'index.asp', 'index.aspx',
+    'default.html', 'default.htm', 'default.asp', 'default.aspx'])
+
+#tracking and session parameters, a trailing * matches any suffix
+DEFAULT_DROP_PARAMS = [
+    'utm_*', 'fbclid', 'gclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga',
+    'sessionid', 'session_id', 'jsessionid', 'phpsessid', 'aspsessionid*', 'cfid', 'cftoken']
+
+
+class Canonicalizer(object):
+    ''' Rewrites urls to one canonical form that the frontier keys them by,
+    so variants of the same page share a fingerprint and are fetched once.
+    The first variant found is the one fetched, as with http and https,
+    which the fingerprint already leaves out.
+
+    The fragment and trailing slashes are always removed. The rules are
+    case (lowercase scheme and host), port (drop the default port), index
+    (drop index.html and similar last segments), query (sort the query
+    parameters) and params (drop tracking and session parameters, in the
+    query and as ;name=value path parameters). Keys are memoized in a
+    bounded cache, most links are found on many pages. '''
+
+    def __init__(self, rules=RULES, drop_params=DEFAULT_DROP_PARAMS, cache_size=65536):
+        self.rules = frozenset(rules)
+        names = [name.strip().lower() for name in drop_params if name.strip()]
+        #saved with the frontier, a save file keyed with other rules is keyed again
+        self.settings = {'rules': sorted(self.rules), 'drop_params': sorted(set(names))}
+        self.drop_names = frozenset(name for name in names if not name.endswith('*'))
+        self.drop_prefixes = tuple(name[:-1] for name in names if name.endswith('*'))
+        self.key = lru_cache(maxsize=cache_size)(self._key)
+
+    def _dropped(self, name):
+        name = name.lower()
+        return name in self.drop_names or name.startswith(self.drop_prefixes)
+
+    def _key(self, url):
+        #(canonical url, its fingerprint)
+        canonical = self.canonicalize(url)
+        return canonical, get_urlfingerprint(canonical)
+
+    def canonicalize(self, url) -> str:
+        try:
+            scheme, netloc, path, query, _ = urlsplit(url)
+        except ValueError:
+            return url.split('#', 1)[0].rstrip('/')
+        if 'case' in self.rules:
+            scheme = scheme.lower()
+            #the user info before the host is case sensitive
+            user, at, host = netloc.rpartition('@')
+            netloc = user + at + host.lower()
+        if 'port' in self.rules:
+            host, colon, port = netloc.rpartition(':')
+            if colon and port == DEFAULT_PORTS.get(scheme.lower()):
+                netloc = host
+        if 'params' in self.rules and ';' in path:
+            #java style session ids in the path, e.g. /page;jsessionid=...
+            segments = path.split('/')
+            for i, segment in enumerate(segments):
+                if ';' in segment:
+                    name, *params = segment.split(';')
+                    params = [p for p in params if not self._dropped(p.partition('=')[0])]
+                    segments[i] = ';'.join([name] + params)
+            path = '/'.join(segments)
+        if 'index' in self.rules:
+            directory, slash, page = path.rpartition('/')
+            if slash and page.lower() in INDEX_PAGES:
+                path = directory + slash
+        if query and ('query' in self.rules or 'params' in self.rules):
+            pairs = [pair for pair in query.split('&') if pair]
+            if 'params' in self.rules:
+                pairs = [pair for pair in pairs if not self._dropped(pair.partition('=')[0])]
+            if 'query' in self.rules:
+                #stable sort on the names, repeated names keep their order
+                pairs.sort(key=lambda pair: pair.partition('=')[0])
+            query = '&'.join(pairs)
+        url = urlunsplit((scheme, netloc, path, query, ''))
+        if url.endswith('/'):
+            return url.rstrip('/')
+        return url
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+
+from array import array
+from threading import Thread
+from queue import Queue
+
+from utils import metrics
+
+
+class Checkpointer(object):
+    ''' Incremental checkpoints: a snapshot file plus an append-only log of deltas.
+
+    Callers submit only what changed since their last checkpoint. A background
+    thread appends each delta to the log as one json line and every
+    compact_every deltas folds the log into a fresh snapshot, so the crawl
+    thread never serializes the whole state. Every delta carries a sequence
+    number and the snapshot records the last one it contains, so a crash in
+    the middle of a compaction never applies a delta twice.
+
+    The state entries named in arrays are lists of unsigned 64 bit ints (url
+    fingerprints, simhashes). The snapshot stores them as raw arrays after a
+    json header, so a restart reads them with one read call instead of parsing
+    them as json. Snapshots written as plain json are still read. '''
+
+    MAGIC = b"CHECKPOINT 2\n"
+
+    def __init__(self, snapshot_path, log_path, empty_state, apply_delta, compact_every=100, arrays=()):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        #empty_state() returns a new empty state, apply_delta(state, delta) merges a delta into it
+        self.empty_state = empty_state
+        self.apply_delta = apply_delta
+        self.compact_every = compact_every
+        self.arrays = tuple(arrays)
+        self.seq = 0
+        self.pending = 0
+        self.queue = Queue()
+        self.thread = None
+
+    def load(self):
+        #rebuild the state from the snapshot and every newer delta in the log
+        state, self.seq, end = self._read()
+        if os.path.exists(self.log_path) and end < os.path.getsize(self.log_path):
+            #a crash can leave the last line half written, the next delta
+            #appended after it would be glued onto it and lost
+            os.truncate(self.log_path, end)
+        return state
+
+    def _read(self):
+        #the state, its sequence number and the bytes of the log up to its last complete line
+        state = self.empty_state()
+        seq = 0
+        end = 0
+        if os.path.exists(self.snapshot_path):
+            state, seq = self._read_snapshot()
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    end += len(line)
+                    if entry["seq"] > seq:
+                        state = self.apply_delta(state, entry["delta"])
+                        seq = entry["seq"]
+        return state, seq, end
+
+    def _read_snapshot(self):
+        with open(self.snapshot_path, 'rb') as file:
+            if file.read(len(self.MAGIC)) != self.MAGIC:
+                #older snapshots are one json document
+                file.seek(0)
+                snapshot = json.load(file)
+                return snapshot["state"], snapshot["seq"]
+            header = json.loads(file.readline())
+            state = header["state"]
+            for name, count in header["arrays"]:
+                values = array('Q')
+                values.frombytes(file.read(values.itemsize * count))
+                if header["byteorder"] != sys.byteorder:
+                    values.byteswap()
+                state[name] = values
+        return state, header["seq"]
+
+    def _write_snapshot(self, path, state, seq):
+        arrays = [(name, state[name] if isinstance(state[name], array) else array('Q', state[name]))
+                  for name in self.arrays]
+        header = {"seq": seq, "byteorder": sys.byteorder,
+                  "state": {k: v for k, v in state.items() if k not in self.arrays},
+                  "arrays": [[name, len(values)] for name, values in arrays]}
+        with open(path, 'wb') as file:
+            file.write(self.MAGIC)
+            file.write(json.dumps(header).encode('utf-8') + b"\n")
+            for name, values in arrays:
+                values.tofile(file)
+
+    def submit(self, delta):
+        #hand a delta to the background writer, returns right away
+        if self.thread == None:
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put(delta)
+
+    def _run(self):
+        while True:
+            delta = self.queue.get()
+            try:
+                if delta == None:
+                    return
+                self.seq += 1
+                with metrics.timer('checkpoint.append'):
+                    with open(self.log_path, 'a') as file:
+                        file.write(json.dumps({"seq": self.seq, "delta": delta}) + "\n")
+                self.pending += 1
+                if self.pending >= self.compact_every:
+                    with metrics.timer('checkpoint.compact'):
+                        self._compact()
+            finally:
+                self.queue.task_done()
+
+    def _compact(self):
+        state, seq, _ = self._read()
+        temp_path = f"{self.snapshot_path}.tmp"
+        self._write_snapshot(temp_path, state, seq)
+        os.replace(temp_path, self.snapshot_path)
+        #every delta in the log is now in the snapshot
+        open(self.log_path, 'w').close()
+        self.pending = 0
+
+    def flush(self):
+        #wait until every submitted delta has been written
+        self.queue.join()
+
+    def close(self):
+        if self.thread != None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
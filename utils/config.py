@@ -8,12 +8,68 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.mode = config["LOCAL PROPERTIES"]["MODE"].strip().lower()
+        assert self.mode in ("threads", "async", "pipeline"), "MODE should be threads, async or pipeline"
+        self.parse_processes = int(config["LOCAL PROPERTIES"]["PARSEPROCESSES"])
+        self.pipeline_queue = int(config["LOCAL PROPERTIES"]["PIPELINEQUEUE"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.durability_interval = float(config["LOCAL PROPERTIES"]["DURABILITYINTERVAL"])
+        self.bloom_capacity = int(config["LOCAL PROPERTIES"]["BLOOMCAPACITY"])
+        self.max_queued = int(config["LOCAL PROPERTIES"]["MAXQUEUED"])
+        self.spill_segment = int(config["LOCAL PROPERTIES"]["SPILLSEGMENT"])
+        self.page_store = config["LOCAL PROPERTIES"]["PAGESTORE"].strip()
+        self.page_store_bytes = int(config["LOCAL PROPERTIES"]["PAGESTOREBYTES"])
+        self.reuse_pages = config["LOCAL PROPERTIES"].getboolean("REUSEPAGES")
+        self.crawl_log = config["LOCAL PROPERTIES"]["CRAWLLOG"].strip()
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.concurrency = int(config["CONNECTION"]["CONCURRENCY"])
+        self.max_connections = int(config["CONNECTION"]["MAXCONNECTIONS"])
+        self.timeout = float(config["CONNECTION"]["TIMEOUT"])
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
+        self.domains = config["CRAWLER"]["DOMAINS"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.max_delay = float(config["CRAWLER"]["MAXDELAY"])
+        self.backoff = float(config["CRAWLER"]["BACKOFF"])
+        self.latency_target = float(config["CRAWLER"]["LATENCYTARGET"])
+        self.recovery = float(config["CRAWLER"]["RECOVERY"])
+        self.max_retries = int(config["CRAWLER"]["MAXRETRIES"])
+        self.retry_budget = float(config["CRAWLER"]["RETRYBUDGET"])
+        self.simhash_distance = int(config["CRAWLER"]["SIMHASHDISTANCE"])
+        self.parser = config["CRAWLER"]["PARSER"].strip().lower()
+        self.max_page_bytes = int(config["CRAWLER"]["MAXPAGEBYTES"])
+        self.trap_samples = int(config["CRAWLER"]["TRAPSAMPLES"])
+        self.trap_min_yield = float(config["CRAWLER"]["TRAPMINYIELD"])
+        #content type -> byte limit, written as type or type:bytes
+        self.content_types = dict()
+        for entry in config["CRAWLER"]["CONTENTTYPES"].split(","):
+            content_type, _, limit = entry.strip().lower().partition(":")
+            self.content_types[content_type] = int(limit) if limit else 0
+        self.max_response_bytes = int(config["CRAWLER"]["MAXRESPONSEBYTES"])
+        self.canonical_rules = [rule.strip().lower() for rule in config["CRAWLER"]["CANONICALRULES"].split(",") if rule.strip()]
+        assert set(self.canonical_rules) <= {"case", "port", "index", "query", "params"}, \
+            "CANONICALRULES should only list case, port, index, query and params"
+        self.drop_params = config["CRAWLER"]["DROPPARAMS"].split(",")
+
+        self.word_counts = config["STATS"]["WORDCOUNTS"].strip().lower()
+        assert self.word_counts in ("exact", "topk"), "WORDCOUNTS should be exact or topk"
+        self.topk_capacity = int(config["STATS"]["TOPKCAPACITY"])
+
+        self.metrics_enabled = config["METRICS"].getboolean("ENABLED")
+        self.metrics_interval = float(config["METRICS"]["DUMPINTERVAL"])
+        self.metrics_port = int(config["METRICS"]["PORT"])
+
+        #host:port of every node's link listener, in node id order, empty for a single node crawl
+        self.node_id = int(config["CLUSTER"]["NODEID"])
+        self.peers = list()
+        for peer in config["CLUSTER"]["PEERS"].split(","):
+            if peer.strip():
+                host, _, port = peer.strip().rpartition(":")
+                self.peers.append((host, int(port)))
+        assert not self.peers or 0 <= self.node_id < len(self.peers), "NODEID should index PEERS"
+        self.forward_batch = int(config["CLUSTER"]["FORWARDBATCH"])
+        self.forward_interval = float(config["CLUSTER"]["FORWARDINTERVAL"])
 
         self.cache_server = None
\ No newline at end of file
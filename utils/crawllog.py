@@ -0,0 +1,128 @@
+import os
+import mmap
+import struct
+
+from collections import namedtuple
+
+#what a processed page turned out to be
+SKIPPED, LOW_INFO, DUPLICATE, KEPT = range(4)
+OUTCOMES = ('skipped', 'low_info', 'duplicate', 'kept')
+
+MAGIC = b"CRAWLLOG 1\n"
+#bytes of the record that follow its length
+LENGTH = struct.Struct('<I')
+#url fingerprint, simhash, status, outcome, token count, url and subdomain lengths
+HEADER = struct.Struct('<QQHBIHH')
+WORD = struct.Struct('<HI')
+
+PageRecord = namedtuple(
+    'PageRecord', ['urlhash', 'simhash', 'status', 'outcome', 'length', 'url', 'subdomain', 'words'])
+
+
+def _encode_text(text) -> bytes:
+    #at most 0xffff bytes, cut between two characters so the record still decodes
+    data = text.encode('utf-8')
+    if len(data) > 0xffff:
+        data = data[:0xffff].decode('utf-8', 'ignore').encode('utf-8')
+    return data
+
+
+def encode_record(urlhash, simhash, status, outcome, length, url, subdomain, words) -> bytes:
+    #one processed page, words maps each counted word to its count on the page
+    url = _encode_text(url)
+    subdomain = (subdomain or '').encode('utf-8')
+    parts = [b'', HEADER.pack(urlhash, simhash, status, outcome, length, len(url), len(subdomain)),
+             url, subdomain, LENGTH.pack(len(words))]
+    for word, count in words.items():
+        word = _encode_text(word)
+        parts.append(WORD.pack(len(word), count))
+        parts.append(word)
+    parts[0] = LENGTH.pack(sum(len(part) for part in parts))
+    return b''.join(parts)
+
+
+class CrawlLog(object):
+    ''' Append-only binary log of every processed page.
+
+    Each record holds the url fingerprint, simhash, status, outcome, token
+    count, url, ics subdomain and the page's word counts, prefixed by its
+    length so readers can skip the words when they do not need them. The
+    report can be rebuilt from the log after the crawl, see stats.py. Not
+    thread safe, Stats writes to it under its lock. '''
+
+    def __init__(self, path):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) < len(MAGIC)
+        if not new:
+            #a crash can leave the last record half written, appending after
+            #it would make every later record unreadable
+            end = complete_size(path)
+            if end < os.path.getsize(path):
+                os.truncate(path, end)
+        self.file = open(path, 'wb' if new else 'ab', buffering=1 << 20)
+        if new:
+            self.file.write(MAGIC)
+
+    def append(self, records) -> None:
+        #records are encoded with encode_record
+        for record in records:
+            self.file.write(record)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def complete_size(path) -> int:
+    #bytes of the log up to the end of its last complete record, reads only the lengths
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a crawl log")
+        offset, end = len(MAGIC), os.fstat(file.fileno()).st_size
+        while offset + LENGTH.size <= end:
+            (size,) = LENGTH.unpack(file.read(LENGTH.size))
+            if offset + LENGTH.size + size > end:
+                break
+            offset += LENGTH.size + size
+            file.seek(offset)
+        return offset
+
+
+def read_records(path, words=True):
+    ''' Yields every PageRecord in a log. The file is memory mapped and read
+    one record at a time, so memory use does not grow with the log. With
+    words=False the word counts are skipped and words is None. A record cut
+    short by a crash ends the log. '''
+    with open(path, 'rb') as file:
+        if os.path.getsize(path) <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a crawl log")
+            offset, end = len(MAGIC), len(data)
+            while offset + LENGTH.size <= end:
+                (size,) = LENGTH.unpack_from(data, offset)
+                start = offset + LENGTH.size
+                offset = start + size
+                if offset > end:
+                    break
+                urlhash, simhash, status, outcome, length, url_size, subdomain_size = \
+                    HEADER.unpack_from(data, start)
+                position = start + HEADER.size
+                url = data[position:position + url_size].decode('utf-8')
+                position += url_size
+                subdomain = data[position:position + subdomain_size].decode('utf-8') or None
+                position += subdomain_size
+                counts = None
+                if words:
+                    counts = dict()
+                    (distinct,) = LENGTH.unpack_from(data, position)
+                    position += LENGTH.size
+                    for _ in range(distinct):
+                        word_size, count = WORD.unpack_from(data, position)
+                        position += WORD.size
+                        counts[data[position:position + word_size].decode('utf-8')] = count
+                        position += word_size
+                yield PageRecord(urlhash, simhash, status, outcome, length, url, subdomain, counts)
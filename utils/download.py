@@ -2,13 +2,35 @@ import requests
 import cbor
 import time
 
+from threading import local
+
 from utils.response import Response
+from utils import metrics
+
+#one keep-alive session per thread, requests sessions are not thread safe
+_sessions = local()
+
+def get_session():
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
 
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    try:
+        resp = get_session().get(
+            f"http://{host}:{port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")], timeout=config.timeout)
+    except requests.RequestException as e:
+        #same status as the async downloader, the frontier may retry the url later
+        if logger:
+            logger.error(f"Spacetime Response error {e!r} with url {url}.")
+        return Response({
+            "error": f"Spacetime Response error {e!r} with url {url}.",
+            "status": 600,
+            "url": url,
+            "failed": True})
+    metrics.count('bytes_downloaded', len(resp.content))
     try:
         if resp and resp.content:
             return Response(cbor.loads(resp.content))
@@ -18,4 +40,5 @@ def download(url, config, logger=None):
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
-        "url": url})
+        "url": url,
+        "failed": True})
@@ -0,0 +1,131 @@
+from html.parser import HTMLParser
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+#text in these tags is not visible, BeautifulSoup's get_text skips it as well
+HIDDEN_TAGS = frozenset(['script', 'style', 'template'])
+
+
+class _PageCollector(object):
+    ''' Collects visible text and anchor hrefs from parser events in one pass. '''
+
+    def __init__(self):
+        self.text = []
+        self.hrefs = []
+        self.hidden = 0
+
+    def start(self, tag, attrs):
+        tag = tag.lower()
+        if tag in HIDDEN_TAGS:
+            self.hidden += 1
+        elif tag == 'a':
+            href = attrs.get('href')
+            if href != None:
+                self.hrefs.append(href)
+
+    def end(self, tag):
+        if tag.lower() in HIDDEN_TAGS and self.hidden > 0:
+            self.hidden -= 1
+
+    def data(self, data):
+        if not self.hidden:
+            self.text.append(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return ''.join(self.text), self.hrefs
+
+
+def _first_attrs(attrs) -> dict:
+    #a repeated attribute keeps its first value, as in browsers and libxml2
+    values = dict()
+    for name, value in attrs:
+        values.setdefault(name, value)
+    return values
+
+
+class _StreamParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.collector = _PageCollector()
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, _first_attrs(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        #self closing tags never open a hidden region
+        if tag.lower() not in HIDDEN_TAGS:
+            self.collector.start(tag, _first_attrs(attrs))
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def _decode(content: bytes) -> str:
+    #every backend reads the page as utf-8, so they find the same text and links
+    return content.decode('utf-8', errors='replace')
+
+
+def _parse_stream(content: bytes) -> tuple:
+    parser = _StreamParser()
+    parser.feed(_decode(content))
+    parser.close()
+    return parser.collector.close()
+
+
+def _parse_lxml(content: bytes) -> tuple:
+    if not content:
+        return '', []
+    parser = etree.HTMLParser(target=_PageCollector())
+    try:
+        #given bytes without a meta charset libxml2 would read them as latin-1
+        parser.feed(_decode(content))
+        return parser.close()
+    except etree.LxmlError:
+        #libxml2 gives up on some broken pages that html.parser still reads
+        return _parse_stream(content)
+
+
+def _parse_soup(content: bytes) -> tuple:
+    #the original two pass parse, kept for comparison
+    soup = BeautifulSoup(_decode(content), 'html.parser', on_duplicate_attribute='ignore')
+    hrefs = [link.get('href') for link in soup.find_all('a')]
+    return soup.get_text(), [href for href in hrefs if href != None]
+
+
+def get_backend(name: str) -> str:
+    #auto picks lxml when it is installed, otherwise the standard library stream parser
+    if name == 'auto':
+        return 'lxml' if etree != None else 'stream'
+    if name == 'lxml' and etree == None:
+        raise ImportError("PARSER = lxml but lxml is not installed")
+    if name == 'soup' and BeautifulSoup == None:
+        raise ImportError("PARSER = soup but bs4 is not installed")
+    if name not in ('lxml', 'stream', 'soup'):
+        raise ValueError(f"Unknown PARSER {name}, use auto, lxml, stream or soup")
+    return name
+
+
+def parse_page(content: bytes, backend: str = 'stream', max_bytes: int = 0) -> tuple:
+    ''' Returns (visible text, list of anchor hrefs) for an html page.
+    Only the first max_bytes of the page are parsed when max_bytes > 0. '''
+    if max_bytes > 0 and len(content) > max_bytes:
+        content = content[:max_bytes]
+    if backend == 'lxml':
+        return _parse_lxml(content)
+    if backend == 'soup':
+        return _parse_soup(content)
+    return _parse_stream(content)
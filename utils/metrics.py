@@ -0,0 +1,229 @@
+''' Low overhead counters, gauges and stage timers for a running crawl.
+
+Call sites always go through the module functions (metrics.timer,
+metrics.count, metrics.observe). While metrics are disabled those names are
+bound to no-ops, so instrumentation costs one empty call. configure() rebinds
+them to the real implementations and starts the periodic dump and the
+optional local HTTP endpoint. '''
+
+import time
+import logging
+
+from bisect import bisect_left
+from threading import Thread, Lock, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#upper bounds in seconds of the latency histogram buckets, the last one catches the rest
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        #upper bound of the bucket holding the q quantile
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+
+class Registry(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = dict()
+        self.histograms = dict()
+        #name -> function returning the current value
+        self.gauges = dict()
+        self.started = time.time()
+        #counter values at the last dump, for rates
+        self.last_dump = (time.time(), dict())
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def rates(self):
+        #per second rate of every counter since the previous call
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+        then, previous = self.last_dump
+        self.last_dump = (now, counters)
+        elapsed = max(now - then, 1e-9)
+        return {name: (value - previous.get(name, 0)) / elapsed for name, value in counters.items()}
+
+    def render(self) -> str:
+        #plain text, one metric per line, in the prometheus exposition format
+        lines = list()
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = [(name, list(h.counts), h.total, h.count) for name, h in sorted(self.histograms.items())]
+        elapsed = max(time.time() - self.started, 1e-9)
+        for name, value in counters:
+            lines.append(f'crawler_{name}_total {value}')
+            lines.append(f'crawler_{name}_per_sec {value / elapsed:.3f}')
+        for name, gauge in sorted(self.gauges.items()):
+            try:
+                lines.append(f'crawler_{name} {gauge()}')
+            except Exception:
+                pass
+        for name, counts, total, count in histograms:
+            seen = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                seen += bucket
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'crawler_stage_seconds_bucket{{stage="{name}",le="{le}"}} {seen}')
+            lines.append(f'crawler_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'crawler_stage_seconds_count{{stage="{name}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        #one line per stage for the log: count, total time, mean and p95
+        parts = list()
+        for name, rate in sorted(self.rates().items()):
+            parts.append(f'{name}/s={rate:.2f}')
+        for name, gauge in sorted(self.gauges.items()):
+            try:
+                parts.append(f'{name}={gauge()}')
+            except Exception:
+                pass
+        lines = [' '.join(parts)]
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda x: -x[1].total)
+            for name, h in histograms:
+                lines.append(
+                    f'  {name}: n={h.count} total={h.total:.2f}s '
+                    f'mean={1000 * h.total / max(h.count, 1):.2f}ms p95<={h.quantile(0.95)}s')
+        return '\n'.join(lines)
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+registry = Registry()
+enabled = False
+_stop = Event()
+_threads = list()
+_server = None
+
+
+def _null_timer(name):
+    return _NULL_TIMER
+
+def _null_count(name, value=1):
+    pass
+
+def _null_observe(name, seconds):
+    pass
+
+def _timer(name):
+    return _Timer(name)
+
+#rebound by configure(), call sites must use metrics.timer and not import the names
+timer = _null_timer
+count = _null_count
+observe = _null_observe
+
+
+def gauge(name, function):
+    #gauges are only read when metrics are dumped, so registering one is free
+    registry.gauge(name, function)
+
+
+def configure(config, logger=None):
+    global timer, count, observe, enabled, _server
+    if not config.metrics_enabled or enabled:
+        return
+    enabled = True
+    timer = _timer
+    count = registry.count
+    observe = registry.observe
+    _stop.clear()
+    if config.metrics_interval > 0:
+        thread = Thread(target=_dump_loop, args=(config.metrics_interval, logger), daemon=True)
+        thread.start()
+        _threads.append(thread)
+    if config.metrics_port > 0:
+        _server = ThreadingHTTPServer(('127.0.0.1', config.metrics_port), _MetricsHandler)
+        _server.daemon_threads = True
+        thread = Thread(target=_server.serve_forever, daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def _dump_loop(interval, logger):
+    logger = logger or logging.getLogger("METRICS")
+    while not _stop.wait(interval):
+        logger.info(f"Metrics: {registry.summary()}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stop(logger=None):
+    #final dump and shut down the background threads
+    global _server
+    if not enabled:
+        return
+    _stop.set()
+    if logger:
+        logger.info(f"Metrics: {registry.summary()}")
+    if _server != None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,121 @@
+#statuses of a host that is overloaded or asking to slow down
+OVERLOAD_STATUSES = frozenset([429, 503])
+
+#weight of the newest fetch in the per host latency and failure averages
+SMOOTHING = 0.2
+#retries a host can save up, so a long healthy run does not allow a burst of them
+MAX_RETRY_TOKENS = 10.0
+#shortest delay after a failure, so a host without politeness delay backs off too
+MIN_BACKOFF = 0.5
+#a delay this close to the politeness delay is back at it
+SETTLED = 0.01
+
+
+def is_overloaded(resp) -> bool:
+    #no usable reply from the cache server, or the host asking to slow down. The
+    #cache server keeps the host's reply, so only the first case is worth a retry
+    return resp.failed or resp.status in OVERLOAD_STATUSES
+
+
+class HostRate(object):
+    __slots__ = ('delay', 'latency', 'failure_rate', 'fetches', 'failures', 'retry_tokens')
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.latency = None
+        self.failure_rate = 0.0
+        self.fetches = 0
+        self.failures = 0
+        #one retry is allowed before the host has earned any
+        self.retry_tokens = 1.0
+
+
+class RateController(object):
+    ''' Delay between two fetches of a host, adapted to how the host answers.
+
+    A failed fetch multiplies the delay by backoff. While the smoothed
+    latency of the host is above latency_target every reply adds recovery of
+    the delay, otherwise every reply takes recovery of the delay above
+    min_delay off. With the defaults a host failing less than about 30% of
+    its fetches settles back at min_delay, one failing more keeps backing off
+    up to max_delay. The delay never goes below min_delay, the politeness
+    delay, so a healthy host is fetched exactly as often as before.
+
+    A fetch without a usable reply may be retried after the backoff, at most max_retries
+    times per url and only while its host has retry tokens: every successful
+    fetch earns retry_budget of a token and every retry spends one, so
+    retries stay a bounded share of the fetches. Not thread safe, the
+    frontier calls it under its lock. '''
+
+    def __init__(self, min_delay, max_delay=60.0, backoff=2.0, latency_target=2.0, recovery=0.25,
+                 max_retries=2, retry_budget=0.1):
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.recovery = recovery
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.hosts = dict()
+        #url -> retries so far, while the url waits for its next attempt
+        self.attempts = dict()
+
+    def _get(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostRate(self.min_delay)
+        return self.hosts[host]
+
+    def delay(self, host) -> float:
+        rate = self.hosts.get(host)
+        return rate.delay if rate != None else self.min_delay
+
+    def record(self, host, seconds, failed) -> None:
+        #one download of the host: how long it took and whether it failed
+        rate = self._get(host)
+        rate.fetches += 1
+        rate.latency = seconds if rate.latency == None else rate.latency + SMOOTHING * (seconds - rate.latency)
+        rate.failure_rate += SMOOTHING * (float(failed) - rate.failure_rate)
+        if failed:
+            rate.failures += 1
+            delay = max(rate.delay, MIN_BACKOFF) * self.backoff
+        else:
+            rate.retry_tokens = min(MAX_RETRY_TOKENS, rate.retry_tokens + self.retry_budget)
+            if rate.latency > self.latency_target:
+                delay = rate.delay * (1.0 + self.recovery)
+            else:
+                delay = rate.delay - self.recovery * (rate.delay - self.min_delay)
+                if delay - self.min_delay < SETTLED:
+                    delay = self.min_delay
+        rate.delay = min(self.max_delay, max(self.min_delay, delay))
+
+    def retry(self, host, url) -> bool:
+        #whether a failed fetch of the url is tried again, spends a retry token if so
+        rate = self._get(host)
+        retries = self.attempts.get(url, 0)
+        if retries >= self.max_retries or rate.retry_tokens < 1.0:
+            return False
+        rate.retry_tokens -= 1.0
+        self.attempts[url] = retries + 1
+        return True
+
+    def retrying(self, url) -> bool:
+        return url in self.attempts
+
+    def done(self, url) -> None:
+        #the url was processed, successfully or not
+        self.attempts.pop(url, None)
+
+    def rates(self) -> dict:
+        #host -> current delay, smoothed latency and failure rate, fetches, failures and retry tokens
+        return {host: {'delay': rate.delay, 'latency': rate.latency, 'failure_rate': rate.failure_rate,
+                       'fetches': rate.fetches, 'failures': rate.failures, 'retry_tokens': rate.retry_tokens}
+                for host, rate in self.hosts.items()}
+
+    def backed_off(self) -> int:
+        #hosts currently waiting longer than the politeness delay
+        return sum(1 for rate in self.hosts.values() if rate.delay > self.min_delay)
+
+    def mean_delay(self) -> float:
+        if not self.hosts:
+            return self.min_delay
+        return sum(rate.delay for rate in self.hosts.values()) / len(self.hosts)
@@ -1,14 +1,57 @@
 import pickle
 
 class Response(object):
+    ''' A reply from the cache server. The pickled requests.Response is kept
+    as bytes and only unpickled the first time raw_response or its headers
+    are used, so a reply that is skipped by size is never unpickled and a
+    skipped content type is never decoded or parsed. '''
+
     def __init__(self, resp_dict):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        #set by the downloaders when the cache server gave no usable reply at all
+        self.failed = resp_dict.get("failed", False)
+        self._pickled = resp_dict.get("response")
+        self._raw_response = None
+
+    @property
+    def raw_response(self):
+        if self._pickled != None:
+            pickled, self._pickled = self._pickled, None
+            try:
+                self._raw_response = pickle.loads(pickled)
+            except (TypeError, pickle.UnpicklingError, EOFError):
+                self._raw_response = None
+        return self._raw_response
+
+    @raw_response.setter
+    def raw_response(self, value):
+        self._pickled = None
+        self._raw_response = value
+
+    @property
+    def size(self) -> int:
+        #bytes of the pickled reply, an upper bound of the body size known without unpickling
+        if self._pickled != None:
+            return len(self._pickled)
+        raw = self._raw_response
+        return len(raw.content or b'') if raw != None else 0
+
+    @property
+    def headers(self):
+        raw = self.raw_response
+        return raw.headers if raw != None else {}
+
+    @property
+    def content_type(self) -> str:
+        #media type without parameters, e.g. text/html, or '' if the header is missing
+        return self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+
+    @property
+    def content_length(self) -> int:
+        length = self.headers.get("Content-Length")
+        if length != None and length.isdigit():
+            return int(length)
+        raw = self.raw_response
+        return len(raw.content or b'') if raw != None else 0
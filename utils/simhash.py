@@ -0,0 +1,153 @@
+from hashlib import blake2b
+from threading import RLock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FINGERPRINT_BITS = 64
+#tokens are voted in chunks so huge pages do not build a giant bit matrix
+CHUNK_SIZE = 65536
+
+
+def hash64(token: str) -> int:
+    #stable 64 bit hash, unlike hash() it does not change between processes
+    return int.from_bytes(
+        blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def compute_simhash(weights: dict) -> int:
+    #weights maps each distinct token to its weight (frequency on the page)
+    if np is not None:
+        return _compute_simhash_numpy(weights)
+    return _compute_simhash_python(weights)
+
+
+def _compute_simhash_numpy(weights: dict) -> int:
+    count = len(weights)
+    if count == 0:
+        return 0
+    hashes = np.fromiter((hash64(k) for k in weights.keys()), dtype='<u8', count=count)
+    counts = np.fromiter(weights.values(), dtype=np.int64, count=count)
+    #sum of weights of the tokens that have each bit set
+    ones = np.zeros(FINGERPRINT_BITS, dtype=np.int64)
+    for start in range(0, count, CHUNK_SIZE):
+        chunk = hashes[start:start + CHUNK_SIZE]
+        bits = np.unpackbits(chunk.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+        ones += counts[start:start + CHUNK_SIZE] @ bits.astype(np.int64)
+    #a bit is set when the tokens with it set outweigh the tokens without it
+    votes = 2 * ones - int(counts.sum())
+    fingerprint = 0
+    for bit in np.flatnonzero(votes > 0):
+        fingerprint |= 1 << int(bit)
+    return fingerprint
+
+
+def _compute_simhash_python(weights: dict) -> int:
+    ones = [0] * FINGERPRINT_BITS
+    total = 0
+    for k, v in weights.items():
+        h = hash64(k)
+        total += v
+        bit = 0
+        while h:
+            if h & 1:
+                ones[bit] += v
+            h >>= 1
+            bit += 1
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if 2 * ones[bit] - total > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimhashIndex(object):
+    ''' Near-duplicate index over 64 bit simhash fingerprints.
+
+    The fingerprint is split into max_distance + 1 blocks of bits. Two
+    fingerprints within max_distance bits of each other must agree exactly on
+    at least one block (pigeonhole), so a query only compares against the
+    fingerprints that share a block instead of every stored fingerprint. '''
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.lock = RLock()
+        self._fingerprints = set()
+        #fingerprints added since the last take_new, for incremental checkpoints
+        self._new = list()
+        blocks = max_distance + 1
+        self._masks = list()
+        start = 0
+        for i in range(blocks):
+            width = FINGERPRINT_BITS // blocks + (1 if i < FINGERPRINT_BITS % blocks else 0)
+            self._masks.append(((1 << width) - 1) << start)
+            start += width
+        #one table per block, mapping the block bits to the fingerprints that have them
+        self._tables = [dict() for _ in self._masks]
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self._fingerprints))
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._fingerprints
+
+    def add(self, fingerprint: int) -> None:
+        with self.lock:
+            if fingerprint in self._fingerprints:
+                return
+            self._fingerprints.add(fingerprint)
+            self._new.append(fingerprint)
+            for mask, table in zip(self._masks, self._tables):
+                key = fingerprint & mask
+                if key in table:
+                    table[key].append(fingerprint)
+                else:
+                    table[key] = [fingerprint]
+
+    def find_near(self, fingerprint: int):
+        #return a stored fingerprint within max_distance bits, or None
+        with self.lock:
+            if fingerprint in self._fingerprints:
+                return fingerprint
+            for mask, table in zip(self._masks, self._tables):
+                for candidate in table.get(fingerprint & mask, ()):
+                    if hamming_distance(fingerprint, candidate) <= self.max_distance:
+                        return candidate
+        return None
+
+    def add_if_unique(self, fingerprint: int) -> bool:
+        #check and add in one step so two workers cannot both miss each other
+        with self.lock:
+            if self.find_near(fingerprint) is not None:
+                return False
+            self.add(fingerprint)
+            return True
+
+    def take_new(self) -> list:
+        #return the fingerprints added since the last call and start over
+        with self.lock:
+            new = self._new
+            self._new = list()
+        return new
+
+    def load(self, fingerprints) -> None:
+        #bulk add, one pass per block table instead of one add call per fingerprint
+        with self.lock:
+            new = set(fingerprints)
+            new.difference_update(self._fingerprints)
+            self._fingerprints.update(new)
+            for mask, table in zip(self._masks, self._tables):
+                setdefault = table.setdefault
+                for fingerprint in new:
+                    setdefault(fingerprint & mask, []).append(fingerprint)
+            #loaded fingerprints are already checkpointed
@@ -0,0 +1,136 @@
+import heapq
+
+
+class SpaceSaving(object):
+    ''' Space-Saving heavy hitters summary with a fixed number of counters.
+
+    When every counter is taken, a new word replaces a word with the smallest
+    count and inherits that count as its error. Counts are never under the
+    true count and over it by at most the word's error, which is itself at most
+    total / capacity. Any word whose true count is above total / capacity is
+    guaranteed to be in the summary. Counters are grouped in buckets by count
+    with a heap of the bucket counts, so an update costs O(log capacity). '''
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.total = 0
+        self._counts = dict()
+        self._errors = dict()
+        #count -> set of words with that count
+        self._buckets = dict()
+        #counts of the buckets, may hold stale counts that are skipped lazily
+        self._heap = list()
+        #words whose counter changed and words that lost their counter since take_changes
+        self._changed = set()
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, word):
+        return word in self._counts
+
+    def _bucket_add(self, word, count):
+        if count in self._buckets:
+            self._buckets[count].add(word)
+        else:
+            self._buckets[count] = {word}
+            heapq.heappush(self._heap, count)
+            if len(self._heap) > 4 * len(self._buckets) + 64:
+                #too many stale counts, rebuild the heap from the live buckets
+                self._heap = list(self._buckets.keys())
+                heapq.heapify(self._heap)
+
+    def _bucket_remove(self, word, count):
+        bucket = self._buckets[count]
+        bucket.discard(word)
+        if not bucket:
+            del self._buckets[count]
+
+    def min_count(self) -> int:
+        while self._heap:
+            if self._heap[0] in self._buckets:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return 0
+
+    def add(self, word: str, count: int = 1) -> None:
+        self.total += count
+        self._changed.add(word)
+        if word in self._counts:
+            old = self._counts[word]
+            self._bucket_remove(word, old)
+            self._counts[word] = old + count
+            self._bucket_add(word, old + count)
+        elif len(self._counts) < self.capacity:
+            self._counts[word] = count
+            self._errors[word] = 0
+            self._bucket_add(word, count)
+            self._removed.discard(word)
+        else:
+            #replace a word with the smallest count, its count becomes the error
+            smallest = self.min_count()
+            victim = next(iter(self._buckets[smallest]))
+            self._bucket_remove(victim, smallest)
+            del self._counts[victim]
+            del self._errors[victim]
+            self._changed.discard(victim)
+            self._removed.add(victim)
+            self._counts[word] = smallest + count
+            self._errors[word] = smallest
+            self._bucket_add(word, smallest + count)
+            self._removed.discard(word)
+
+    def get(self, word: str) -> int:
+        return self._counts.get(word, 0)
+
+    def error_bound(self) -> int:
+        #no count in the summary is over its true count by more than this
+        return max(self._errors.values(), default=0)
+
+    def top(self, k: int) -> list:
+        #(word, count, error) for the k largest counts, ties broken alphabetically
+        best = heapq.nsmallest(k, self._counts.items(), key=lambda x: (-x[1], x[0]))
+        return [(word, count, self._errors[word]) for word, count in best]
+
+    def merge(self, other) -> None:
+        #fold another summary in, the errors of both add up
+        for word, count in other._counts.items():
+            self.add(word, count)
+            self._errors[word] = self._errors.get(word, 0) + other._errors[word]
+
+    def to_state(self) -> dict:
+        return {'capacity': self.capacity, 'total': self.total,
+                'counts': {word: [count, self._errors[word]] for word, count in self._counts.items()}}
+
+    def take_changes(self) -> dict:
+        #the counters changed and the words evicted since the last call, applying them
+        #with apply_changes to the state of that call gives the state now
+        changes = {'capacity': self.capacity, 'total': self.total,
+                   'counts': {word: [self._counts[word], self._errors[word]] for word in self._changed},
+                   'removed': list(self._removed)}
+        self._changed = set()
+        self._removed = set()
+        return changes
+
+    @staticmethod
+    def apply_changes(state: dict, changes: dict) -> dict:
+        counts = state['counts']
+        for word in changes['removed']:
+            counts.pop(word, None)
+        counts.update(changes['counts'])
+        state['capacity'] = changes['capacity']
+        state['total'] = changes['total']
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict, capacity=None):
+        summary = cls(capacity or state['capacity'])
+        for word, (count, error) in state['counts'].items():
+            summary.add(word, count)
+            summary._errors[word] = summary._errors.get(word, 0) + error
+        summary.total = state['total']
+        if summary.capacity == state['capacity']:
+            #a copy of a saved summary, nothing has changed since it was saved
+            summary._changed = set()
+        return summary
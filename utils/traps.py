@@ -0,0 +1,121 @@
+import re
+
+from urllib.parse import urlparse
+
+NUMBER_RE = re.compile(r'\d+')
+#session ids, hashes and similar long hex runs
+HEX_ID_RE = re.compile(r'[0-9a-f]{16,}', re.IGNORECASE)
+
+
+def url_pattern(url: str) -> str:
+    ''' Groups urls that only differ by numbers, ids or query values: host,
+    path with numbers replaced, and the sorted query keys. Calendar days,
+    page numbers and reordered query strings all map to one pattern. '''
+    parsed = urlparse(url)
+    path = NUMBER_RE.sub('{n}', HEX_ID_RE.sub('{id}', parsed.path))
+    keys = sorted({pair.split('=', 1)[0] for pair in parsed.query.split('&') if pair})
+    return f"{parsed.netloc.lower()}{path}?{'&'.join(keys)}"
+
+
+class PatternYield(object):
+    __slots__ = ('fetched', 'kept', 'low_info', 'duplicate', 'new_links', 'stopped')
+
+    def __init__(self):
+        self.fetched = 0
+        self.kept = 0
+        self.low_info = 0
+        self.duplicate = 0
+        self.new_links = 0
+        self.stopped = False
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_list(cls, values):
+        stats = cls()
+        for name, value in zip(cls.__slots__, values):
+            setattr(stats, name, value)
+        return stats
+
+
+class TrapDetector(object):
+    ''' Fetch budgets per url pattern, grown by the pattern's yield.
+
+    Every pattern may fetch samples urls to show what it yields. After that
+    it may only keep fetching while at least min_yield of its fetches were
+    kept (not low info, not a near duplicate, not an error): the budget is
+    samples + kept / min_yield. Productive patterns never run out, calendar
+    and pagination traps that keep producing duplicates or empty pages are
+    throttled and then stopped. Not thread safe, the frontier calls it under
+    its lock. '''
+
+    def __init__(self, samples=30, min_yield=0.1, logger=None):
+        self.samples = samples
+        self.min_yield = min_yield
+        self.logger = logger
+        self.patterns = dict()
+
+    def _get(self, pattern):
+        if pattern not in self.patterns:
+            self.patterns[pattern] = PatternYield()
+        return self.patterns[pattern]
+
+    def _budget(self, stats):
+        return self.samples + stats.kept / self.min_yield
+
+    def allow(self, url: str) -> bool:
+        #False once the pattern of the url has used up its budget
+        if self.min_yield <= 0:
+            return True
+        stats = self.patterns.get(url_pattern(url))
+        return stats == None or not stats.stopped
+
+    def fetch(self, url: str) -> bool:
+        #counts a fetch against the budget of its pattern, False if it is used up
+        if self.min_yield <= 0:
+            return True
+        pattern = url_pattern(url)
+        stats = self._get(pattern)
+        if stats.stopped:
+            return False
+        if stats.fetched >= self._budget(stats):
+            stats.stopped = True
+            if self.logger:
+                self.logger.info(
+                    f"Stopped fetching {pattern} after {stats.fetched} fetches: {stats.kept} kept, "
+                    f"{stats.low_info} low info, {stats.duplicate} duplicates, {stats.new_links} new links.")
+            return False
+        stats.fetched += 1
+        return True
+
+    def record_page(self, url: str, outcome: str) -> None:
+        #outcome is kept, low_info or duplicate, a fetch without a record counts as an error
+        if self.min_yield <= 0:
+            return
+        stats = self._get(url_pattern(url))
+        if outcome == 'kept':
+            stats.kept += 1
+        elif outcome == 'low_info':
+            stats.low_info += 1
+        elif outcome == 'duplicate':
+            stats.duplicate += 1
+
+    def record_links(self, url: str, new_links: int) -> None:
+        if self.min_yield > 0 and new_links:
+            self._get(url_pattern(url)).new_links += new_links
+
+    def pattern_yield(self, url: str, min_fetched=5):
+        #fraction of the fetches of the url's pattern that were kept, None until it has min_fetched
+        stats = self.patterns.get(url_pattern(url))
+        if stats == None or stats.fetched < min_fetched:
+            return None
+        return min(1.0, stats.kept / stats.fetched)
+
+    def state(self) -> dict:
+        #pattern -> counts, so a restart does not sample every pattern again
+        return {pattern: stats.to_list() for pattern, stats in self.patterns.items()}
+
+    def load(self, state: dict) -> None:
+        for pattern, values in state.items():
+            self.patterns[pattern] = PatternYield.from_list(values)
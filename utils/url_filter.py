@@ -0,0 +1,86 @@
+from functools import lru_cache
+from urllib.parse import urlparse
+
+#file extensions that never point to a web page
+SKIPPED_EXTENSIONS = frozenset([
+    'css', 'js', 'bmp', 'gif', 'jpg', 'jpeg', 'ico',
+    'png', 'tif', 'tiff', 'mid', 'mp2', 'mp3', 'mp4',
+    'wav', 'avi', 'mov', 'mpeg', 'ram', 'm4v', 'mkv', 'ogg', 'ogv', 'pdf',
+    'ps', 'eps', 'tex', 'ppt', 'pptx', 'doc', 'docx', 'xls', 'xlsx', 'names',
+    'data', 'dat', 'exe', 'bz2', 'tar', 'msi', 'bin', '7z', 'psd', 'dmg', 'iso',
+    'epub', 'dll', 'cnf', 'tgz', 'sha1',
+    'thmx', 'mso', 'arff', 'rtf', 'jar', 'csv',
+    'rm', 'smil', 'wmv', 'swf', 'wma', 'zip', 'rar', 'gz'])
+
+DEFAULT_DOMAINS = [
+    '.ics.uci.edu', '.cs.uci.edu', '.informatics.uci.edu', '.stat.uci.edu',
+    'today.uci.edu/department/information_computer_sciences']
+
+
+class UrlFilter(object):
+    ''' Decides which urls get crawled. Built once from the domain rules.
+
+    A rule is a domain, optionally followed by a path prefix that urls on that
+    domain must start with. A rule starting with a dot matches any host ending
+    with it, otherwise the host must be the domain or one of its subdomains.
+    Host verdicts and whole url verdicts are memoized in bounded caches. '''
+
+    def __init__(self, domains=DEFAULT_DOMAINS, extensions=SKIPPED_EXTENSIONS, cache_size=65536):
+        #domain -> list of allowed path prefixes, None if every path is allowed
+        self.suffix_rules = dict()
+        self.exact_rules = dict()
+        for rule in domains:
+            rule = rule.strip()
+            if not rule:
+                continue
+            domain, slash, prefix = rule.partition('/')
+            domain = domain.lower()
+            rules = self.suffix_rules if domain.startswith('.') else self.exact_rules
+            if not slash:
+                rules[domain] = None
+            elif rules.get(domain, []) != None:
+                rules.setdefault(domain, []).append(slash + prefix)
+        self.extensions = frozenset(extensions)
+        self._host_paths = lru_cache(maxsize=cache_size)(self._find_host_paths)
+        self.is_valid = lru_cache(maxsize=cache_size)(self._is_valid)
+
+    def _find_host_paths(self, host):
+        #returns the allowed path prefixes for the host, None for any path, False if not allowed
+        allowed = False
+        for domain, paths in self.exact_rules.items():
+            if host == domain or host.endswith('.' + domain):
+                if paths == None:
+                    return None
+                allowed = (allowed or []) + paths
+        for domain, paths in self.suffix_rules.items():
+            if host.endswith(domain):
+                if paths == None:
+                    return None
+                allowed = (allowed or []) + paths
+        return allowed
+
+    def _is_valid(self, url) -> bool:
+        try:
+            parsed = urlparse(url)
+        except ValueError:
+            #malformed urls such as broken ipv6 hosts
+            return False
+        if parsed.scheme not in ('http', 'https'):
+            return False
+        host = parsed.hostname
+        if not host:
+            return False
+        paths = self._host_paths(host)
+        if paths == False:
+            return False
+        if paths != None and not any(parsed.path.startswith(p) for p in paths):
+            return False
+        #set lookup of the last extension instead of one big regex
+        path = parsed.path.lower()
+        dot = path.rfind('.')
+        return dot == -1 or path[dot + 1:] not in self.extensions
+
+    def filter_links(self, links) -> list:
+        #validate a whole page of links in one call
+        is_valid = self.is_valid
+        return [link for link in links if is_valid(link)]
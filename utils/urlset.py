@@ -0,0 +1,148 @@
+import os
+import math
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class FingerprintSet(object):
+    ''' Set of 64 bit url fingerprints stored in one flat array.
+
+    Open addressing with linear probing over an array of unsigned 64 bit
+    ints, so each url costs 8 bytes divided by the load factor instead of a
+    full Python string and set entry. 0 marks an empty slot, fingerprints
+    from get_urlfingerprint are never 0. '''
+
+    def __init__(self, capacity=1024, max_load=0.6):
+        self.max_load = max_load
+        size = 16
+        while size * max_load < capacity:
+            size *= 2
+        self._table = array('Q', bytes(8 * size))
+        self._mask = size - 1
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return (fingerprint for fingerprint in self._table if fingerprint)
+
+    def _find(self, table, mask, fingerprint):
+        #index of the fingerprint, or of the empty slot where it belongs
+        i = (fingerprint ^ (fingerprint >> 32)) & mask
+        while True:
+            slot = table[i]
+            if slot == fingerprint or slot == 0:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, fingerprint):
+        return self._table[self._find(self._table, self._mask, fingerprint)] == fingerprint
+
+    def add(self, fingerprint: int) -> bool:
+        #returns True if the fingerprint was not in the set yet
+        i = self._find(self._table, self._mask, fingerprint)
+        if self._table[i] == fingerprint:
+            return False
+        self._table[i] = fingerprint
+        self._count += 1
+        if self._count > len(self._table) * self.max_load:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = self._table
+        table = array('Q', bytes(16 * len(old)))
+        mask = len(table) - 1
+        for fingerprint in old:
+            if fingerprint:
+                table[self._find(table, mask, fingerprint)] = fingerprint
+        self._table = table
+        self._mask = mask
+
+    def update(self, fingerprints) -> None:
+        for fingerprint in fingerprints:
+            self.add(fingerprint)
+
+    @property
+    def nbytes(self) -> int:
+        return self._table.itemsize * len(self._table)
+
+    def bytes_per_item(self) -> float:
+        return self.nbytes / self._count if self._count else 0.0
+
+
+class BloomFilter(object):
+    ''' Bloom filter over 64 bit fingerprints, sized for capacity items at
+    the given false positive rate. A miss means the item was never added. '''
+
+    def __init__(self, capacity, error_rate=0.01):
+        bits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.size = bits
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self._bits = bytearray((bits + 7) // 8)
+
+    def _positions(self, fingerprint):
+        #double hashing, the two halves of the fingerprint give every probe
+        h1 = fingerprint & 0xffffffff
+        h2 = (fingerprint >> 32) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, fingerprint: int) -> None:
+        for position in self._positions(fingerprint):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, fingerprints) -> None:
+        #add many fingerprints at once, every probe of every fingerprint in one numpy pass when installed
+        if np is None:
+            for fingerprint in fingerprints:
+                self.add(fingerprint)
+            return
+        keys = np.fromiter(fingerprints, dtype=np.uint64)
+        if len(keys) == 0:
+            return
+        h1 = keys & np.uint64(0xffffffff)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        bits = np.unpackbits(np.frombuffer(bytes(self._bits), dtype=np.uint8), bitorder='little')
+        for i in range(self.hashes):
+            bits[(h1 + np.uint64(i) * h2) % np.uint64(self.size)] = 1
+        self._bits = bytearray(np.packbits(bits, bitorder='little').tobytes())
+
+    def __contains__(self, fingerprint):
+        for position in self._positions(fingerprint):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def write(self, path, token) -> None:
+        #header line with the parameters and a token the owner checks on read, then the raw bits
+        with open(path, 'wb') as file:
+            file.write(f"BLOOM {self.size} {self.hashes} {token}\n".encode('ascii'))
+            file.write(self._bits)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read(self, path, token) -> bool:
+        #load the bits saved by write, False if the file does not match this filter and token
+        try:
+            with open(path, 'rb') as file:
+                if file.readline().split() != [b'BLOOM', str(self.size).encode('ascii'),
+                                                str(self.hashes).encode('ascii'), token.encode('ascii')]:
+                    return False
+                bits = file.read()
+        except OSError:
+            return False
+        if len(bits) != len(self._bits):
+            return False
+        self._bits = bytearray(bits)
+        return True